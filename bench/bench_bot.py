@@ -0,0 +1,312 @@
+# End-to-end load test of the bot against a local fake Bot API and a fake
+# extractor serving synthetic media. Drives the real handlers:
+# download_media -> quality_selection -> process_queue -> handle_download_logic.
+#
+#   python bench/bench_bot.py --users 50 --concurrency 4
+#   python bench/bench_bot.py --flood-rate 0.05 --upload-kbps 8192 --output logs/bench_bot.jsonl
+#   python bench/bench_bot.py --compare logs/bench_bot.jsonl    # diff against the last matching run
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import FakeBotAPI, MediaServer
+
+SUCCESS_TEXT = "✅ Download complete"
+FAILURE_PREFIXES = ("⚠️ Download failed", "⚠️ Error", "⏳ The bot is very busy", "🔒", "🚫", "❌")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def configure_environment(args, api, workdir):
+    # main.py and the modules it imports read these at import time
+    os.environ.update({
+        "BOT_TOKEN": "123456:bench",
+        "BOT_API_URL": api.base_url,
+        "OWNER_ID": "1",
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "METRICS_PATH": os.path.join(workdir, "job_metrics.jsonl"),
+        "STARTUP_LOG_PATH": os.path.join(workdir, "startup_times.jsonl"),
+        "SCRATCH_DIR": os.path.join(workdir, "downloads"),
+        "COOKIE_FILE": os.path.join(workdir, "cookies.txt"),
+        "METRICS_PORT": "0",
+        "DOWNLOAD_WORKERS": str(args.concurrency),
+        "DOWNLOAD_BACKLOG": str(args.users),
+        "EXTRACT_BACKLOG": str(args.users),
+        "QUEUE_WORKERS": "0",  # started below, so the run controls them
+        "STREAM_UPLOADS": "1" if args.stream else "0",
+    })
+
+
+def fake_extractor(media, extract_delay):
+    # Stands in for yt-dlp's extraction: one progressive mp4 format per URL,
+    # served by the local MediaServer, so the download itself is real
+    from utils import VideoMetadata
+
+    def extract_metadata(url):
+        time.sleep(extract_delay)
+        video_id = url.rstrip("/").rsplit("/", 1)[-1]
+        info = {
+            "id": f"bench{video_id}",
+            "title": f"Bench video {video_id}",
+            "extractor": "bench",
+            "extractor_key": "Bench",
+            "webpage_url": url,
+            "original_url": url,
+            "duration": 60,
+            "formats": [{
+                "format_id": "360p",
+                "url": media.video_url,
+                "ext": "mp4",
+                "protocol": "http",
+                "width": 640,
+                "height": 360,
+                "vcodec": "avc1.42001e",
+                "acodec": "mp4a.40.2",
+                "filesize": len(media.video),
+            }],
+        }
+        return VideoMetadata(url, info)
+    return extract_metadata
+
+
+def text_update(bot, update_id, chat_id, text):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }, bot)
+
+
+def callback_update(bot, update_id, chat_id, data):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+                "text": "Select the quality you want:",
+            },
+        },
+    }, bot)
+
+
+def keyboard_choice(api, chat_id):
+    for call in api.calls_for(chat_id):
+        if call["reply_markup"]:
+            buttons = json.loads(call["reply_markup"]).get("inline_keyboard") or []
+            if buttons:
+                return buttons[0][0]["callback_data"]
+    return None
+
+
+def outcome(api, chat_id):
+    for call in api.calls_for(chat_id):
+        text = call["text"] or ""
+        if text.startswith(SUCCESS_TEXT):
+            return "done"
+        if text.startswith(FAILURE_PREFIXES):
+            return "failed"
+    return None
+
+
+async def run_user(app, api, index, started_at, args):
+    chat_id = 100000 + index
+    url = f"{args.media_base}/v/{0 if args.same_url else index}"
+    await asyncio.sleep(index / args.arrival_rate if args.arrival_rate else 0)
+    started_at[chat_id] = time.time()
+    await app.process_update(text_update(app.bot, index * 2 + 1, chat_id, url))
+
+    data = keyboard_choice(api, chat_id)
+    if data is None:
+        return chat_id  # no keyboard: downloaded straight away, or failed
+    await app.process_update(callback_update(app.bot, index * 2 + 2, chat_id, data))
+    return chat_id
+
+
+async def sample_resources(peaks, scratch_dir, stop):
+    from scratch import directory_size
+
+    while not stop.is_set():
+        peaks["disk"] = max(peaks["disk"], await asyncio.to_thread(directory_size, scratch_dir))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args, api, media):
+    import main
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    main.extract_metadata = fake_extractor(media, args.extract_ms / 1000)
+    main.init_db()
+    app = main.build_application()
+    await app.initialize()
+    # Same handlers run_bot() registers for these updates
+    from telegram.ext import CallbackQueryHandler, MessageHandler, filters
+
+    app.add_handler(CallbackQueryHandler(main.quality_selection, pattern=main.QUALITY_PATTERN))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main.download_media))
+
+    workers = [asyncio.create_task(main.process_queue(app, worker_id)) for worker_id in range(args.concurrency)]
+    peaks = {"disk": 0}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_resources(peaks, os.environ["SCRATCH_DIR"], stop))
+
+    started_at = {}
+    began = time.time()
+    chats = await asyncio.gather(*(run_user(app, api, index, started_at, args) for index in range(args.users)))
+    deadline = time.time() + args.timeout
+    while time.time() < deadline and any(outcome(api, chat_id) is None for chat_id in chats):
+        await asyncio.sleep(0.1)
+    finished = time.time()
+
+    stop.set()
+    await sampler
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await app.shutdown()
+
+    ttfb, delivery = [], []
+    outcomes = {"done": 0, "failed": 0, "timeout": 0}
+    for chat_id in chats:
+        result = outcome(api, chat_id) or "timeout"
+        outcomes[result] += 1
+        uploads = [call for call in api.calls_for(chat_id) if call["method"] == "sendVideo"]
+        if uploads:
+            ttfb.append(uploads[0]["started"] - started_at[chat_id])
+        delivered = [call for call in uploads if not call["flooded"]]
+        if result == "done" and delivered:
+            delivery.append(delivered[0]["finished"] - started_at[chat_id])
+
+    calls = [call for call in api.calls if call["method"] not in ("getMe", "getUpdates", "deleteWebhook")]
+    elapsed = finished - began
+    return {
+        "jobs": args.users,
+        "completed": outcomes["done"],
+        "failed": outcomes["failed"],
+        "timed_out": outcomes["timeout"],
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_min": round(outcomes["done"] / elapsed * 60, 2) if elapsed else None,
+        "ttfb_p50_s": rounded(percentile(ttfb, 0.5)),
+        "ttfb_p95_s": rounded(percentile(ttfb, 0.95)),
+        "ttfb_p99_s": rounded(percentile(ttfb, 0.99)),
+        "delivery_p50_s": rounded(percentile(delivery, 0.5)),
+        "delivery_p95_s": rounded(percentile(delivery, 0.95)),
+        "delivery_p99_s": rounded(percentile(delivery, 0.99)),
+        "api_calls_per_job": round(len(calls) / args.users, 2),
+        "api_429s": sum(1 for call in calls if call["flooded"]),
+        # Whole process, fake servers included; ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_disk_mb": round(peaks["disk"] / (1024 * 1024), 1),
+    }
+
+
+def rounded(value):
+    return None if value is None else round(value, 3)
+
+
+CONFIG_KEYS = (
+    "users", "concurrency", "arrival_rate", "video_mb", "bandwidth_kbps", "latency_ms",
+    "upload_kbps", "flood_rate", "extract_ms", "stream", "same_url",
+)
+COMPARE_KEYS = (
+    "jobs_per_min", "ttfb_p50_s", "ttfb_p95_s", "delivery_p50_s", "delivery_p95_s", "delivery_p99_s",
+    "api_calls_per_job", "peak_rss_mb", "peak_disk_mb",
+)
+
+
+def compare(path, config, result):
+    # Last saved run with the same configuration, side by side with this one
+    if not os.path.exists(path):
+        print(f"No baseline in {path}")
+        return
+    with open(path) as baseline_file:
+        baselines = [json.loads(line) for line in baseline_file if line.strip()]
+    baseline = next((b for b in reversed(baselines) if b.get("config") == config), None)
+    if baseline is None:
+        print(f"No run with this configuration in {path}")
+        return
+    print(f"\n{'metric':>20}  {'baseline':>10}  {'now':>10}  {'change':>8}")
+    for key in COMPARE_KEYS:
+        before, after = baseline["result"].get(key), result.get(key)
+        change = f"{(after - before) / before:+.0%}" if before and after is not None else ""
+        print(f"{key:>20}  {before if before is not None else '-':>10}  {after if after is not None else '-':>10}  {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a fake Bot API")
+    parser.add_argument("--users", type=int, default=20, help="simulated users, one job each")
+    parser.add_argument("--concurrency", type=int, default=2, help="queue workers / download threads")
+    parser.add_argument("--arrival-rate", type=float, default=0, help="users per second (0 = all at once)")
+    parser.add_argument("--video-mb", type=float, default=4)
+    parser.add_argument("--bandwidth-kbps", type=float, default=8192, help="source, per connection, KiB/s")
+    parser.add_argument("--latency-ms", type=float, default=20, help="source, per request")
+    parser.add_argument("--upload-kbps", type=float, default=0, help="fake Bot API, per request, KiB/s (0 = unlimited)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Bot API calls answered with 429")
+    parser.add_argument("--extract-ms", type=float, default=200, help="simulated extraction time")
+    parser.add_argument("--stream", action="store_true", help="allow streaming uploads (STREAM_UPLOADS=1)")
+    parser.add_argument("--same-url", action="store_true", help="every user sends the same link")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's logs and yt-dlp's output")
+    parser.add_argument("--output", help="append the run as a JSON line")
+    parser.add_argument("--compare", help="print the change against the last matching run in this file")
+    args = parser.parse_args()
+
+    segment_size = 256 * 1024
+    with tempfile.TemporaryDirectory() as workdir, FakeBotAPI(
+        flood_rate=args.flood_rate,
+        upload_bandwidth=args.upload_kbps * 1024,
+    ) as api, MediaServer(
+        segments=max(1, int(args.video_mb * 1024 * 1024 / segment_size)),
+        segment_size=segment_size,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_kbps * 1024,
+    ) as media:
+        configure_environment(args, api, workdir)
+        args.media_base = media.base_url
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            result = asyncio.run(run(args, api, media))
+
+    config = {key: getattr(args, key) for key in CONFIG_KEYS}
+    print(json.dumps(result, indent=2))
+    if args.compare:
+        compare(args.compare, config, result)
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps({"timestamp": time.time(), "config": config, "result": result}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Throughput of each download engine profile against a local HLS/HTTP fixture.
+#
+#   python bench/bench_download.py --profiles default fragmented --repeat 3
+#   python bench/bench_download.py --output logs/bench_download.json
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp import YoutubeDL
+
+from bench.fixtures import MediaServer
+from profiles import PROFILES, ydl_options_for
+
+
+def run_once(url, profile_name, directory):
+    options = {
+        "outtmpl": os.path.join(directory, "%(id)s.%(ext)s"),
+        "quiet": True,
+        "noprogress": True,
+        "fixup": "never",  # synthetic segments aren't real media
+        **ydl_options_for(profile_name=profile_name),
+    }
+    started = time.perf_counter()
+    with YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=True)
+        path = ydl.prepare_filename(info)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark download engine profiles")
+    parser.add_argument("--profiles", nargs="*", default=list(PROFILES))
+    parser.add_argument("--source", choices=["hls", "http"], default="hls")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--segment-kb", type=int, default=512)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--bandwidth-kbps", type=float, default=4096, help="per connection, KiB/s")
+    parser.add_argument("--output", help="append results as JSON lines")
+    args = parser.parse_args()
+
+    results = []
+    with MediaServer(
+        segments=args.segments,
+        segment_size=args.segment_kb * 1024,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_kbps * 1024,
+    ) as server:
+        url = server.hls_url if args.source == "hls" else server.video_url
+        for profile_name in args.profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                runs = [run_once(url, profile_name, directory) for _ in range(args.repeat)]
+            size = runs[0][0]
+            best = min(elapsed for _, elapsed in runs)
+            mean = sum(elapsed for _, elapsed in runs) / len(runs)
+            result = {
+                "profile": profile_name,
+                "source": args.source,
+                "bytes": size,
+                "best_s": round(best, 3),
+                "mean_s": round(mean, 3),
+                "mb_per_s": round(size / best / (1024 * 1024), 2),
+                "timestamp": time.time(),
+            }
+            results.append(result)
+            print(f"{profile_name:>12}  {result['mb_per_s']:8.2f} MB/s  best {best:6.2f}s  mean {mean:6.2f}s")
+
+    if args.output:
+        with open(args.output, "a") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
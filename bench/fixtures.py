@@ -0,0 +1,283 @@
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl
+
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Downloaders hang up mid-body all the time (ranges, retries); not news
+        if not isinstance(sys.exc_info()[1], (ConnectionError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class MediaServer:
+    # Local stand-in for a video site: a synthetic HLS stream at /hls/index.m3u8
+    # and a progressive file at /video.mp4 (with Range support). `latency`
+    # (seconds per request) and `bandwidth` (bytes/s per connection) make it
+    # behave like a remote CDN, so fetching fragments in parallel pays off.
+    def __init__(self, segments=40, segment_size=512 * 1024, latency=0.05, bandwidth=4 * 1024 * 1024):
+        self.segments = [os.urandom(segment_size) for _ in range(segments)]
+        self.video = b"".join(self.segments)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self._server = QuietServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def hls_url(self):
+        return f"{self.base_url}/hls/index.m3u8"
+
+    @property
+    def video_url(self):
+        return f"{self.base_url}/video.mp4"
+
+    def playlist(self):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for index in range(len(self.segments)):
+            lines += ["#EXTINF:4.0,", f"seg{index}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type, head_only=False):
+                status = 200
+                start, end = 0, len(body) - 1
+                match = RANGE_RE.match(self.headers.get("Range", ""))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), end) if match.group(2) else end
+                    status = 206
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+                self.end_headers()
+                if head_only:
+                    return
+                chunk = 64 * 1024
+                for offset in range(start, end + 1, chunk):
+                    piece = body[offset:min(offset + chunk, end + 1)]
+                    self.wfile.write(piece)
+                    if server.bandwidth:
+                        time.sleep(len(piece) / server.bandwidth)
+
+            def _route(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                if self.path == "/hls/index.m3u8":
+                    return server.playlist(), "application/vnd.apple.mpegurl"
+                match = re.fullmatch(r"/hls/seg(\d+)\.ts", self.path)
+                if match and int(match.group(1)) < len(server.segments):
+                    return server.segments[int(match.group(1))], "video/mp2t"
+                if self.path == "/video.mp4":
+                    return server.video, "video/mp4"
+                return None, None
+
+            def do_HEAD(self):
+                body, content_type = self._route()
+                if body is None:
+                    self.send_error(404)
+                    return
+                self._send(body, content_type, head_only=True)
+
+            def do_GET(self):
+                body, content_type = self._route()
+                if body is None:
+                    self.send_error(404)
+                    return
+                self._send(body, content_type)
+
+        return Handler
+
+
+FIELD_RE = re.compile(rb'name="([^"]+)"(?:; filename="[^"]*")?\r\n(?:[^\r\n]+\r\n)*\r\n', re.S)
+UPLOAD_METHODS = ("sendVideo", "sendDocument", "sendAudio")
+
+
+def parse_form(body, content_type):
+    # Plain fields of a Bot API request; file contents are skipped
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        boundary = content_type.split("boundary=", 1)[1].encode()
+        fields = {}
+        for part in body.split(b"--" + boundary):
+            match = FIELD_RE.search(part)
+            if match and b"filename=" not in part[:match.end()]:
+                fields[match.group(1).decode()] = part[match.end():].rstrip(b"\r\n").decode(errors="replace")
+        return fields
+    return dict(parse_qsl(body.decode()))
+
+
+class FakeBotAPI:
+    # Local stand-in for api.telegram.org: answers every method with a
+    # plausible result and records (method, chat, timings, bytes) for each
+    # call. `flood_rate` is the share of calls answered with a 429, and
+    # `upload_bandwidth` (bytes/s per request) slows down reading bodies.
+    def __init__(self, flood_rate=0.0, retry_after=1, upload_bandwidth=0, seed=1):
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.upload_bandwidth = upload_bandwidth
+        self.calls = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1000)
+        self._server = QuietServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        # What the bot gets as BOT_API_URL; the token is appended to it
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def calls_for(self, chat_id, method=None):
+        with self._lock:
+            return [
+                call for call in self.calls
+                if str(call["chat_id"]) == str(chat_id) and (method is None or call["method"] == method)
+            ]
+
+    def _flooded(self, method):
+        if method in ("getMe", "getUpdates", "deleteWebhook") or not self.flood_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.flood_rate
+
+    def _result(self, method, fields):
+        chat = {"id": int(fields.get("chat_id") or 0), "type": "private", "first_name": "Bench"}
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getUpdates":
+            time.sleep(min(float(fields.get("timeout") or 0), 1))
+            return []
+        if method in ("sendMessage", "editMessageText"):
+            return {**message, "text": fields.get("text", "")}
+        if method == "sendPhoto":
+            return {**message, "photo": [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]}
+        if method in UPLOAD_METHODS:
+            kind = {"sendVideo": "video", "sendDocument": "document", "sendAudio": "audio"}[method]
+            media = {"file_id": f"{kind}-{message['message_id']}", "file_unique_id": f"u{message['message_id']}"}
+            if kind == "video":
+                media.update(width=640, height=360, duration=1)
+            elif kind == "audio":
+                media.update(duration=1)
+            return {**message, kind: media}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                chunks = []
+                while length > 0:
+                    chunk = self.rfile.read(min(64 * 1024, length))
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    length -= len(chunk)
+                    if api.upload_bandwidth:
+                        time.sleep(len(chunk) / api.upload_bandwidth)
+                return b"".join(chunks)
+
+            def do_POST(self):
+                started = time.time()
+                method = self.path.rsplit("/", 1)[-1]
+                body = self._read_body()
+                fields = parse_form(body, self.headers.get("Content-Type", ""))
+                flooded = api._flooded(method)
+                if flooded:
+                    payload = {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {api.retry_after}",
+                        "parameters": {"retry_after": api.retry_after},
+                    }
+                    status = 429
+                else:
+                    payload = {"ok": True, "result": api._result(method, fields)}
+                    status = 200
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with api._lock:
+                    api.calls.append({
+                        "method": method,
+                        "chat_id": fields.get("chat_id"),
+                        "text": fields.get("text"),
+                        "reply_markup": fields.get("reply_markup"),
+                        "bytes": len(body),
+                        "started": started,
+                        "finished": time.time(),
+                        "flooded": flooded,
+                    })
+
+            do_GET = do_POST
+
+        return Handler
@@ -0,0 +1,106 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+
+# Signed stream URLs carry their own deadline, e.g. ?expire=1712345678 or
+# googlevideo's /expire/1712345678/ path segment
+EXPIRY_PARAMS = ("expire", "expires", "exp", "validto")
+EXPIRY_PATH_RE = re.compile(r"/expire/(\d{9,11})(?:/|$)")
+EXPIRY_SAFETY_MARGIN = 60  # seconds, so we never hand out a URL about to die
+
+
+def url_expiry(url):
+    parts = urlsplit(url)
+    for key, value in parse_qsl(parts.query):
+        if key.lower() in EXPIRY_PARAMS and value.isdigit():
+            return int(value)
+    match = EXPIRY_PATH_RE.search(parts.path)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def stream_expiry(info):
+    # Earliest expiry across every format URL (and playlist entries)
+    deadlines = []
+    for fmt in info.get("formats") or []:
+        for key in ("url", "manifest_url", "fragment_base_url"):
+            if fmt.get(key):
+                deadline = url_expiry(fmt[key])
+                if deadline:
+                    deadlines.append(deadline)
+    for entry in info.get("entries") or []:
+        if entry:
+            deadline = stream_expiry(entry)
+            if deadline:
+                deadlines.append(deadline)
+    return min(deadlines) if deadlines else None
+
+
+class MetadataCache:
+    # Size-capped LRU with a global TTL and optional per-entry deadlines.
+    # Shared between the event loop and worker threads, hence the lock.
+    def __init__(self, max_entries=256, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        if self.max_entries <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at - EXPIRY_SAFETY_MARGIN)
+        if deadline <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (deadline, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
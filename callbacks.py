@@ -0,0 +1,38 @@
+import base64
+import hashlib
+import json
+
+# Telegram rejects callback_data longer than 64 bytes
+CALLBACK_DATA_LIMIT = 64
+QUALITY_PREFIX = "q"
+SEPARATOR = "|"
+# Matches both the compact encoding and the JSON payloads of older keyboards
+QUALITY_PATTERN = r"^(q\||\{)"
+
+
+def short_hash(text, length=8):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")[:length]
+
+
+def encode_quality(video_id, format_id, index):
+    # "q|<video_id>|<format_id>", or "q|<video_id>|#<index>" for format ids
+    # too long to fit (some DASH/HLS ids are)
+    data = SEPARATOR.join((QUALITY_PREFIX, video_id, format_id))
+    if len(data.encode("utf-8")) <= CALLBACK_DATA_LIMIT:
+        return data
+    return SEPARATOR.join((QUALITY_PREFIX, video_id, f"#{index}"))
+
+
+def decode_quality(data):
+    # Returns (video_id, format_id, index); exactly one of format_id/index is set
+    if data.startswith("{"):
+        payload = json.loads(data)
+        return payload["video_id"], payload["format_id"], None
+
+    prefix, video_id, selection = data.split(SEPARATOR, 2)
+    if prefix != QUALITY_PREFIX or not video_id or not selection:
+        raise ValueError(f"Not a quality callback: {data!r}")
+    if selection.startswith("#"):
+        return video_id, None, int(selection[1:])
+    return video_id, selection, None
@@ -0,0 +1,62 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BusyError(Exception):
+    pass
+
+
+class BoundedPool:
+    # Thread pool that refuses new work once `workers + backlog` calls are
+    # pending, so a flood of links turns into a "busy" reply instead of an
+    # ever-growing executor queue
+    def __init__(self, name, workers, backlog):
+        self.name = name
+        self.workers = workers
+        self.limit = workers + backlog
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    @property
+    def saturated(self):
+        return self.pending >= self.limit
+
+    async def run(self, fn, *args, **kwargs):
+        if self.saturated:
+            raise BusyError(f"{self.name} pool is full ({self.pending}/{self.limit})")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {"workers": self.workers, "pending": self.pending, "limit": self.limit}
+
+
+extract_pool = BoundedPool(
+    "extract",
+    workers=int(os.getenv("EXTRACT_WORKERS", 4)),
+    backlog=int(os.getenv("EXTRACT_BACKLOG", 16)),
+)
+download_pool = BoundedPool(
+    "download",
+    workers=int(os.getenv("DOWNLOAD_WORKERS", 2)),
+    backlog=int(os.getenv("DOWNLOAD_BACKLOG", 8)),
+)
+
+
+async def run_extraction(fn, *args, **kwargs):
+    return await extract_pool.run(fn, *args, **kwargs)
+
+
+async def run_download(fn, *args, **kwargs):
+    return await download_pool.run(fn, *args, **kwargs)
+
+
+async def run_io(fn, *args, **kwargs):
+    # Small file-system calls (remove, stat, ...) that just shouldn't block the loop
+    return await asyncio.to_thread(fn, *args, **kwargs)
@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import socket
+import ssl
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Retries (extraction and download) for failures that may go away on their own
+FAILURE_RETRIES = int(os.getenv("FAILURE_RETRIES", 2))
+FAILURE_BACKOFF_BASE = float(os.getenv("FAILURE_BACKOFF_BASE", 2))  # seconds, doubled per attempt
+FAILURE_BACKOFF_MAX = float(os.getenv("FAILURE_BACKOFF_MAX", 30))
+
+# A site is paused for BREAKER_COOLDOWN seconds once at least BREAKER_MIN_CALLS
+# of its last BREAKER_WINDOW jobs ran and BREAKER_ERROR_RATE of them failed
+# on the site's side. After the cooldown one trial job decides.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 300))
+MAX_BREAKERS = 1024  # beyond this, healthy closed breakers are forgotten
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# kind: (retryable, the site's fault, message for the user)
+KINDS = {
+    "geo": (False, False, "🚫 This video is locked or unavailable in your region."),
+    "unavailable": (False, False, "❌ The video link is invalid or has been removed."),
+    "unsupported": (False, False, "❌ This link isn't supported."),
+    "login_required": (False, False, "🔒 This video is private, age-restricted or for members only."),
+    "forbidden": (False, True, "🚫 Access denied. The site may require login or region access."),
+    "rate_limited": (True, True, "⏳ The site is limiting our requests. Please try again later."),
+    "server": (True, True, "⚠️ The site is having trouble right now. Please try again later."),
+    "network": (True, True, "⚠️ Couldn't reach the site. Please try again later."),
+    "extractor": (False, True, None),  # site changed under yt-dlp
+    "telegram": (False, False, None),  # our side; PTB and the rate limiter retry those
+    "local": (False, False, None),  # our side: ffmpeg, disk, a bug in the bot
+    "unknown": (False, True, None),  # some other yt-dlp error
+}
+# Expected extractor errors are about one video, except when the site is
+# turning us away as a whole. Block hints are checked first: YouTube's bot
+# check also says "Sign in".
+BLOCK_HINTS = ("not a bot", "being blocked", "unusual traffic", "rate-limited", "too many requests")
+LOGIN_HINTS = (
+    "login", "log in", "sign in", "cookies", "private", "confirm your age", "age-restricted",
+    "members only", "members-only",
+)
+NETWORK_ERRORS = (socket.timeout, socket.gaierror, ssl.SSLError, TimeoutError, ConnectionError)
+
+
+class Failure:
+    def __init__(self, kind, error, status=None):
+        self.kind = kind
+        self.error = error
+        self.status = status
+        self.retryable, self.site_fault, message = KINDS[kind]
+        self.message = message or f"⚠️ Download failed: `{error}`"
+
+    def __repr__(self):
+        return f"Failure({self.kind}, status={self.status})"
+
+
+def _causes(error):
+    # yt-dlp wraps the real cause (DownloadError -> ExtractorError -> HTTPError)
+    seen = []
+    while error is not None and error not in seen and len(seen) < 8:
+        seen.append(error)
+        exc_info = getattr(error, "exc_info", None)
+        wrapped = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        error = wrapped or getattr(error, "cause", None) or error.__cause__ or error.__context__
+    return seen
+
+
+def _http_kind(status):
+    if status in (404, 410):
+        return "unavailable"
+    if status in (401, 403):
+        return "forbidden"
+    if status in (423, 451):
+        return "geo"
+    if status == 429:
+        return "rate_limited"
+    if status >= 500:
+        return "server"
+    return None
+
+
+def classify(error):
+    from yt_dlp.networking.exceptions import HTTPError, TransportError
+    from yt_dlp.utils import (
+        ContentTooShortError, ExtractorError, GeoRestrictedError, PostProcessingError, UnsupportedError,
+        YoutubeDLError,
+    )
+    from urllib.error import HTTPError as UrllibHTTPError
+
+    causes = _causes(error)
+    # The innermost specific cause wins: an ExtractorError caused by a 404 is a 404
+    for cause in causes:
+        if isinstance(cause, (HTTPError, UrllibHTTPError, httpx.HTTPStatusError)):
+            if isinstance(cause, httpx.HTTPStatusError):
+                status = cause.response.status_code
+            else:
+                status = getattr(cause, "status", None) or getattr(cause, "code", None)
+            kind = _http_kind(status or 0)
+            if kind:
+                return Failure(kind, error, status)
+    for cause in causes:
+        if isinstance(cause, TelegramError):
+            return Failure("telegram", error)
+        if isinstance(cause, GeoRestrictedError):
+            return Failure("geo", error)
+        if isinstance(cause, UnsupportedError):
+            return Failure("unsupported", error)
+        if isinstance(cause, (TransportError, ContentTooShortError, httpx.TransportError) + NETWORK_ERRORS):
+            return Failure("network", error)
+        if isinstance(cause, PostProcessingError):
+            return Failure("local", error)
+    for cause in causes:
+        if isinstance(cause, ExtractorError):
+            if cause.expected:
+                message = str(cause.orig_msg).lower()
+                if any(hint in message for hint in BLOCK_HINTS):
+                    return Failure("forbidden", error)
+                if any(hint in message for hint in LOGIN_HINTS):
+                    return Failure("login_required", error)
+                return Failure("unavailable", error)
+            return Failure("extractor", error)
+    # Only yt-dlp's own errors can be the site's; a full disk (OSError) or
+    # a KeyError in our code is not
+    innermost = causes[-1]
+    if isinstance(innermost, OSError) or not isinstance(innermost, YoutubeDLError):
+        return Failure("local", error)
+    return Failure("unknown", error)
+
+
+def backoff_delay(attempt):
+    # "Full jitter": spreads out the retries of jobs that failed together
+    return random.uniform(0, min(FAILURE_BACKOFF_MAX, FAILURE_BACKOFF_BASE * 2 ** attempt))
+
+
+async def with_retries(fn, *args, retries=FAILURE_RETRIES, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            failure = classify(e)
+            if not failure.retryable or attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            logger.warning(f"{getattr(fn, '__name__', fn)} failed ({failure.kind}), retry {attempt}/{retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+@functools.lru_cache(maxsize=1024)
+def extractor_for(url):
+    # The breaker is checked before extraction, so the extractor comes from
+    # yt-dlp's URL patterns rather than from the extracted info
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.ie_key() != "Generic" and ie.suitable(url):
+            return ie.ie_key()
+    return "Generic"
+
+
+def breaker_key(url, extractor):
+    # The generic extractor covers every site yt-dlp has no extractor for;
+    # one dead domain mustn't pause all of them
+    if extractor == "Generic":
+        return f"Generic:{urlsplit(url).netloc.lower()}"
+    return extractor
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.results = deque(maxlen=window)  # True = the site failed us
+        self.state = STATE_CLOSED
+        self.opened_at = None
+        self.trial_running = False
+        self.trips = 0
+        self.rejected = 0
+        self.last_failure = None
+
+    def allow(self):
+        if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = STATE_HALF_OPEN
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, failure=None):
+        # Called once per allowed job; failure=None means the site did its part
+        failed = failure is not None and failure.site_fault
+        if failed:
+            self.last_failure = failure
+        if self.state == STATE_HALF_OPEN:
+            self.trial_running = False
+            if failed:
+                self._open()
+            else:
+                self.state = STATE_CLOSED
+                self.results.clear()
+                logger.info(f"Circuit for {self.name} closed again")
+            return
+        self.results.append(failed)
+        if self.state == STATE_CLOSED and len(self.results) >= self.min_calls and self.failure_rate >= self.error_rate:
+            self._open()
+
+    def release(self):
+        # The job ended without telling us anything about the site (we were busy)
+        self.trial_running = False
+
+    def _open(self):
+        self.state = STATE_OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        logger.warning(
+            f"Circuit for {self.name} opened for {self.cooldown:.0f}s "
+            f"({self.failure_rate:.0%} of the last {len(self.results)} jobs failed, last: {self.last_failure})"
+        )
+
+    @property
+    def failure_rate(self):
+        return sum(self.results) / len(self.results) if self.results else 0.0
+
+    def retry_in(self):
+        if self.state != STATE_OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failure_rate": self.failure_rate,
+            "calls": len(self.results),
+            "retry_in": self.retry_in(),
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "last_failure": self.last_failure.kind if self.last_failure else None,
+        }
+
+
+class CircuitBreakers:
+    # One breaker per breaker_key() (extractor, or Generic:<host>), made on
+    # first use. Each bot/worker process keeps its own, like the rate
+    # limiter's buckets.
+    def __init__(self, max_breakers=MAX_BREAKERS):
+        self.max_breakers = max_breakers
+        self.breakers = {}
+
+    def get(self, key):
+        if key not in self.breakers:
+            if len(self.breakers) >= self.max_breakers:
+                self._forget_healthy()
+            self.breakers[key] = CircuitBreaker(key)
+        return self.breakers[key]
+
+    def _forget_healthy(self):
+        # Closed breakers with no recent failures hold nothing worth keeping
+        for key in [k for k, b in self.breakers.items() if b.state == STATE_CLOSED and not any(b.results)]:
+            del self.breakers[key]
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in sorted(self.breakers.items())}
+
+
+circuit_breakers = CircuitBreakers()
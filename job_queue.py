@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+
+from cache import stream_expiry, EXPIRY_SAFETY_MARGIN
+from storage import (
+    run_db,
+    enqueue_job,
+    claim_job,
+    renew_lease,
+    finish_job,
+    queue_snapshot,
+    job_counts,
+)
+from utils import VideoMetadata
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of handle_download_logic that count as a delivered job
+SUCCESS_OUTCOMES = ("done", "cached", "keyboard")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, chat_id, user_id, url, format_id, reply_to_msg_id=None, metadata=None, job_id=None):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.url = url
+        self.format_id = format_id
+        self.reply_to_msg_id = reply_to_msg_id
+        self.metadata = metadata
+        self.worker_id = None
+        self.enqueued_at = None
+
+
+def encode_metadata(metadata):
+    # The extraction result travels with the job, so a worker in another
+    # process doesn't have to extract the URL again
+    if metadata is None:
+        return None
+    return zlib.compress(json.dumps(metadata.info).encode("utf-8"))
+
+
+def decode_metadata(url, blob):
+    if not blob:
+        return None
+    info = json.loads(zlib.decompress(blob))
+    deadline = stream_expiry(info)
+    if deadline and deadline - EXPIRY_SAFETY_MARGIN <= time.time():
+        return None  # signed stream URLs went stale while queued; re-extract
+    return VideoMetadata(url, info)
+
+
+class DurableQueue:
+    # Job queue backed by the jobs table in videos.db. Any number of
+    # processes can put() and get(); a job is leased to one worker at a time
+    # and goes back to the queue if that worker stops renewing its lease.
+    def __init__(self, per_user_limit=1, per_user_backlog=10, lease_seconds=120, poll_interval=1.0):
+        self.per_user_limit = per_user_limit
+        self.per_user_backlog = per_user_backlog
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+
+    async def put(self, job):
+        job_id = await run_db(
+            enqueue_job,
+            job.chat_id,
+            job.user_id,
+            job.url,
+            job.format_id,
+            job.reply_to_msg_id,
+            encode_metadata(job.metadata),
+            self.per_user_backlog,
+        )
+        if job_id is None:
+            raise QueueFullError(f"user {job.user_id} already has {self.per_user_backlog} jobs")
+        job.id = job_id
+        self._wakeup.set()  # local workers don't have to wait for the next poll
+        return await self.position(job_id)
+
+    async def get(self, worker_id):
+        while True:
+            self._wakeup.clear()
+            row = await run_db(claim_job, worker_id, self.lease_seconds, self.per_user_limit)
+            if row is not None:
+                job_id, chat_id, user_id, url, format_id, reply_to_msg_id, blob, created_at = row
+                job = Job(chat_id, user_id, url, format_id, reply_to_msg_id, decode_metadata(url, blob), job_id)
+                job.worker_id = worker_id
+                job.enqueued_at = created_at
+                return job
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def keep_leased(self, job):
+        # Run alongside a job; cancel it when the job ends
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await run_db(renew_lease, job.id, job.worker_id, self.lease_seconds):
+                logger.warning(f"Lost the lease on job {job.id}")
+                return
+
+    async def task_done(self, job, outcome="done", error=None):
+        status = "done" if outcome in SUCCESS_OUTCOMES else "failed"
+        await run_db(finish_job, job.id, job.worker_id, status, outcome, error)
+
+    async def position(self, job_id):
+        # Replay the claim order: least recently served user first, one job
+        # per user per round
+        queued, last_served = await run_db(queue_snapshot)
+        per_user = {}
+        for queued_id, user_id in queued:
+            per_user.setdefault(user_id, []).append(queued_id)
+        rotation = sorted(
+            per_user.items(), key=lambda item: (last_served.get(item[0]) or 0, item[1][0])
+        )
+        position = 0
+        for depth in range(max((len(ids) for ids in per_user.values()), default=0)):
+            for _, ids in rotation:
+                if depth < len(ids):
+                    position += 1
+                    if ids[depth] == job_id:
+                        return position
+        return None
+
+    async def counts(self):
+        return await run_db(job_counts)
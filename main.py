@@ -1,8 +1,12 @@
-import pandas as pd
+from startup import startup_timer, TimedUpdatesRequest
 import time
 import logging
 import os
 import asyncio
+import re
+import socket
+import httpx
+from contextlib import aclosing
 from urllib.parse import quote
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import (
@@ -14,59 +18,60 @@ from telegram.ext import (
     CallbackContext,
 )
 from utils import (
-    get_video_info,
-    get_file_size,
-    get_duration,
+    extract_metadata,
+    invalidate_metadata,
+    warm_up,
+    normalize_url,
+    metadata_cache,
     download,
-    get_video_formats,
+    AUDIO_FORMAT,
+    CLEAN_URL_SITES,
+)
+from executors import BusyError, run_extraction, run_download, run_io, download_pool, extract_pool
+from job_queue import DurableQueue, Job, QueueFullError
+from singleflight import SingleFlight
+from streaming import STREAM_UPLOADS, StreamUnavailable, find_streamable_format, stream_video
+from splitting import PartTooLarge, split_media
+from failures import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, breaker_key, circuit_breakers, classify, extractor_for, with_retries
+from ydl_pool import ydl_pool
+from playlists import PlaylistTooLarge, check_entry_count, check_total_size, download_entries, resolve_entries
+from progress import StatusMessage
+from scratch import job_dir, sweep_orphans, usage as scratch_usage, wait_for_room
+from ratelimit import PriorityRateLimiter
+from sizing import CONFIDENCE_EXACT, CONFIDENCE_UNKNOWN, FileTooLargeError, probe_format_size
+from callbacks import encode_quality, decode_quality, QUALITY_PATTERN
+from metrics import begin_job, end_job, timed, add_bytes, add_stage, get_label, set_label, flush_loop, export_xlsx
+import telemetry
+from telemetry import CountingRequest, WorkerGauge, start_metrics_server
+from storage import (
+    init_db,
+    store_video_url,
+    get_video_url,
+    store_file_ids,
+    get_file_ids,
+    delete_file_ids,
+    checkpoint,
+    maintenance_loop,
+    run_db,
 )
 from datetime import datetime, timedelta
-import json
-import sqlite3
-import uuid  # To generate unique IDs
 from telegram.helpers import escape_markdown
+from telegram.error import BadRequest, RetryAfter
 
 from dotenv import load_dotenv
 load_dotenv()
+startup_timer.mark("imports")
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-
-# Function to initialize the database
-def init_db():
-    conn = sqlite3.connect("videos.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS videos (
-            id TEXT PRIMARY KEY,
-            url TEXT
-        )
-    """
-    )
-    conn.commit()
-    conn.close()
-
-
-# Function to store URL and generate an ID
-def store_video_url(url):
-    video_id = str(uuid.uuid4())[:8]  # Generate short unique ID (8 chars)
-    conn = sqlite3.connect("videos.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO videos (id, url) VALUES (?, ?)", (video_id, url))
-    conn.commit()
-    conn.close()
-    return video_id  # Return the unique ID
-
-
-# Function to get the URL from the ID
-def get_video_url(video_id):
-    conn = sqlite3.connect("videos.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT url FROM videos WHERE id = ?", (video_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None  # Return URL if found
+# "polling" for development, "webhook" for production behind a load balancer
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public https base URL, e.g. https://bot.example.com
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
 
 
 logging.basicConfig(
@@ -74,40 +79,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-DOWNLOAD_DIR = "downloads"
-TELEGRAM_MAX_SIZE = 2000 * 1024 * 1024
-
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+# Downloads above this are Premium-only; enforced before and during the download
+FREE_SIZE_LIMIT = int(os.getenv("FREE_SIZE_LIMIT_MB", 50)) * 1024 * 1024
+TOO_LARGE_MESSAGE = (
+    f"🔒 This format is larger than {FREE_SIZE_LIMIT // (1024 * 1024)}MB and only available to Premium users.\n"
+    "Upgrade to download. /upgrade"
+)
+TELEGRAM_MAX_SIZE = int(os.getenv("TELEGRAM_MAX_SIZE", 2000 * 1024 * 1024))
 
 user_ids = {}
 user_count = 0
 
 os.makedirs("logs", exist_ok=True)
 log_file_path = "logs/upload_log.xlsx"
-queue = asyncio.Queue()
-queue_positions = {}  # Dictionary to track queue positions
-if not os.path.exists(log_file_path):
-    df_log = pd.DataFrame(
-        columns=[
-            "User",
-            "File Size",
-            "Download Time",
-            "Upload Time",
-            "Total Time",
-            "Speed",
-        ]
-    )
-    df_log.to_excel(log_file_path, index=False)
-else:
-    df_log = pd.read_excel(log_file_path)
+# Lives in videos.db, shared with any separate worker processes (worker.py)
+queue = DurableQueue(
+    per_user_limit=int(os.getenv("MAX_JOBS_PER_USER", 1)),
+    per_user_backlog=int(os.getenv("MAX_QUEUED_PER_USER", 10)),
+    lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", 120)),
+)
+# Download workers inside the bot process; set to 0 when worker.py runs them
+downloads_in_flight = SingleFlight()
+# Every outgoing Bot API call queues here (see ratelimit.py); /stats shows its backlog
+rate_limiter = PriorityRateLimiter()
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", download_pool.workers))
+
+BUSY_MESSAGE = "⏳ The bot is very busy right now. Please try again in a minute."
 
 def suggest_clean_url(url):
-    if any(site in url for site in ["faphouse.com"]):
+    if any(site in url for site in CLEAN_URL_SITES):
         base_url = url.split("?")[0].split("&")[0]
         return f"👀 Heads up! For smoother downloads, use a clean URL like:\n\n{base_url}"
     return ""
 
 
+def format_size_label(quality_option):
+    size = quality_option.get("filesize")
+    if not size:
+        return "size unknown"
+    approx = "" if quality_option.get("size_confidence") == CONFIDENCE_EXACT else "~"
+    return f"{approx}{size / (1024 * 1024):.2f} MB"
+
+
+def make_caption(title):
+    words = title.split()
+    short_title = " ".join(words[:10]) + "..." if len(words) > 10 else title
+    return f"{short_title} downloaded by @offeyicialBot"
+
+
 def format_time(seconds):
     hrs, rem = divmod(seconds, 3600)
     mins, secs = divmod(rem, 60)
@@ -210,23 +229,6 @@ async def send_delay_message(context, chat_id):
     await context.bot.send_message(chat_id=chat_id, text=message_text)
 
 
-processing_event = asyncio.Event()
-
-
-async def send_processing_message(context, chat_id):
-    processing_message = None
-    while not processing_event.is_set():
-        new_message = await context.bot.send_message(
-            chat_id=chat_id, text="Processing..."
-        )
-        if processing_message:
-            await processing_message.delete()
-        processing_message = new_message
-        await asyncio.sleep(5)
-    if processing_message:
-        await processing_message.delete()
-
-
 async def button(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
@@ -236,79 +238,347 @@ async def button(update: Update, context: CallbackContext) -> None:
         )
 
 
-async def handle_download_logic(chat_id, url, context, selected_format=None, reply_to_msg_id=None):
+def uploaded_file_id(message):
+    media = message.video or message.audio or message.document
+    return media.file_id if media else None
+
+
+# Only cache complete deliveries, never half a playlist
+async def remember_uploads(url, format_id, expected, file_ids, caption=None):
+    if not file_ids or len(file_ids) != expected or None in file_ids:
+        return
+    await run_db(store_file_ids, url, format_id, file_ids, caption)
+
+
+# Re-send a previously uploaded file by its file_id: no download, no upload
+async def send_cached_files(context, chat_id, url, format_id, reply_to_msg_id=None):
+    cached = await run_db(get_file_ids, url, format_id)
+    if not cached:
+        return False
+
     try:
-        sanitized_info = get_video_info(url)
-        file_size = get_file_size(sanitized_info) or 0
+        for file_id, caption in cached:
+            if format_id == AUDIO_FORMAT:
+                await context.bot.send_audio(
+                    chat_id=chat_id,
+                    audio=file_id,
+                    caption=caption,
+                    reply_to_message_id=reply_to_msg_id
+                )
+                continue
+            await context.bot.send_video(
+                chat_id=chat_id,
+                video=file_id,
+                supports_streaming=True,
+                caption=caption,
+                reply_to_message_id=reply_to_msg_id
+            )
+    except BadRequest as e:
+        logger.warning(f"Cached file_id for {url} [{format_id}] rejected, dropping it: {e}")
+        await run_db(delete_file_ids, url, format_id)
+        return False
+
+    logger.info(f"Served {url} [{format_id}] from the file_id cache")
+    return True
+
+
+async def send_video_file(context, chat_id, file_path, caption=None, reply_to_msg_id=None):
+    with open(file_path, "rb") as file:
+        return await context.bot.send_video(
+            chat_id=chat_id,
+            video=file,
+            supports_streaming=True,
+            caption=caption,
+            reply_to_message_id=reply_to_msg_id
+        )
+
+
+async def send_audio_file(context, chat_id, file_path, metadata, caption=None, reply_to_msg_id=None):
+    # Title/performer/duration show up in Telegram's music player
+    with open(file_path, "rb") as file:
+        return await context.bot.send_audio(
+            chat_id=chat_id,
+            audio=file,
+            duration=int(metadata.info.get("duration") or 0) or None,
+            title=metadata.title,
+            performer=metadata.info.get("artist") or metadata.info.get("uploader"),
+            caption=caption,
+            reply_to_message_id=reply_to_msg_id
+        )
+
+
+async def aenumerate(iterable, start=0):
+    index = start
+    async for item in iterable:
+        yield index, item
+        index += 1
+
+
+async def upload_files(context, chat_id, file_paths, status, caption=None, reply_to_msg_id=None, audio_metadata=None):
+    # Sends each downloaded file (split into parts if Telegram would refuse
+    # it) and removes it; returns (files expected, file_ids uploaded).
+    # With audio_metadata the files go out as audio tracks.
+    async def send(path, path_caption):
+        if audio_metadata is not None:
+            return await send_audio_file(context, chat_id, path, audio_metadata, path_caption, reply_to_msg_id)
+        return await send_video_file(context, chat_id, path, path_caption, reply_to_msg_id)
+
+    uploaded = []
+    expected = 0
+    for file_path in file_paths:
+        try:
+            file_size = await run_io(os.path.getsize, file_path)
+            if file_size <= TELEGRAM_MAX_SIZE:
+                expected += 1
+                with timed("upload"):
+                    message = await send(file_path, caption)
+                add_bytes(file_size)
+                uploaded.append(uploaded_file_id(message))
+            else:
+                # Too big for one message: cut on keyframes and send parts as they appear
+                logger.info(f"{file_path} is {file_size} bytes, splitting for Telegram")
+                async with aclosing(split_media(file_path, TELEGRAM_MAX_SIZE)) as parts:
+                    async for part_number, part_path in aenumerate(parts, start=1):
+                        expected += 1
+                        part_caption = f"{caption or ''} (part {part_number})".strip()
+                        status.update(f"📤 Sending part {part_number}... Please wait.")
+                        try:
+                            part_size = await run_io(os.path.getsize, part_path)
+                            with timed("upload"):
+                                message = await send(part_path, part_caption)
+                            add_bytes(part_size)
+                            uploaded.append(uploaded_file_id(message))
+                        finally:
+                            await run_io(os.remove, part_path)
+            await run_io(os.remove, file_path)
+        except PartTooLarge as e:
+            logger.warning(f"Giving up on {file_path}: {e}")
+            await context.bot.send_message(chat_id, str(e))
+        except Exception as e:
+            logger.exception(f"Error sending file {file_path}: {e}")
+            await context.bot.send_message(chat_id, f"⚠️ Error sending the file.\n\n`{str(e)}`", parse_mode="Markdown")
+    return expected, uploaded
+
+
+async def download_and_send(context, chat_id, url, format_id, metadata, caption=None, reply_to_msg_id=None):
+    # One status message per job, edited in place instead of send/pin/unpin/delete per step
+    status = StatusMessage(context.bot, chat_id, reply_to_msg_id)
+    audio = format_id == AUDIO_FORMAT
+    kind = "audio" if audio else "video"
+    try:
+        # Progressive single-file formats go source -> Telegram without touching disk
+        if STREAM_UPLOADS and find_streamable_format(metadata, format_id):
+            try:
+                with timed("status"):
+                    await status.start("📤 Sending video... Please wait.")
+                with timed("stream"):
+                    message = await stream_video(
+                        context.bot, chat_id, metadata, format_id, caption, reply_to_msg_id, max_size=FREE_SIZE_LIMIT
+                    )
+                media = message.video or message.document
+                add_bytes(media.file_size if media else 0)
+                await remember_uploads(url, format_id, 1, [uploaded_file_id(message)], caption)
+                with timed("status"):
+                    await status.finish("✅ Download complete! 🎥")
+                return
+            except (StreamUnavailable, httpx.HTTPError, RetryAfter) as e:
+                # The source stream is spent; the temp-file upload can be retried
+                logger.info(f"Streaming {url} [{format_id}] not possible, using a temp file: {e}")
+
+        with timed("status"):
+            if status.message is None:
+                await status.start(f"📥 Downloading {kind}... Please wait.")
+            else:
+                status.update(f"📥 Downloading {kind}... Please wait.")
+
+        # Everything yt-dlp and ffmpeg write for this job stays in its own directory
+        async with job_dir(f"job{get_label('job_id') or 'direct'}") as work_dir:
+            with timed("download"):
+                file_paths = await with_retries(
+                    run_download, download, url, format_id, metadata, FREE_SIZE_LIMIT, status.progress_hook(), work_dir
+                )
+
+            status.update(f"📤 Sending {kind}... Please wait.")
+            expected, uploaded = await upload_files(
+                context, chat_id, file_paths, status, caption, reply_to_msg_id, metadata if audio else None
+            )
+            await remember_uploads(url, format_id, expected, uploaded, caption)
+
+        with timed("status"):
+            await status.finish("✅ Download complete! 🎥")
+    finally:
+        # Failed before finishing: drop the status message, the caller reports the error
+        if not status.finished:
+            with timed("status"):
+                await status.finish()
+
+
+async def deliver_playlist(context, chat_id, url, metadata, format_id=None, reply_to_msg_id=None):
+    # Entries are resolved and the limits checked before any media is fetched;
+    # then a few entries download at a time and each is sent as soon as its own
+    # download finishes, instead of after the whole playlist
+    total = check_entry_count(metadata)
+    status = StatusMessage(context.bot, chat_id, reply_to_msg_id)
+    try:
+        with timed("status"):
+            await status.start(f"🔎 Checking {total} playlist videos... Please wait.")
+        with timed("extract"):
+            entries = await resolve_entries(metadata)
+        check_total_size(entries)
+        failed = total - len(entries)
+        sent = 0
+
+        # Entries sent before (alone or in another playlist) come from the file_id cache
+        pending = []
+        for position, entry in entries:
+            if await send_cached_files(context, chat_id, entry.url, format_id, reply_to_msg_id):
+                sent += 1
+            else:
+                pending.append((position, entry))
+
+        status.update(f"📥 Downloading playlist: {sent}/{total} sent... Please wait.")
+        async with job_dir(f"playlist{get_label('job_id') or 'direct'}") as work_dir:
+            async with aclosing(download_entries(pending, work_dir, format_id, FREE_SIZE_LIMIT)) as results:
+                async for position, entry, result in results:
+                    if isinstance(result, Exception):
+                        logger.warning(f"Playlist entry {position} of {url} failed: {result}")
+                        failed += 1
+                        continue
+                    caption = make_caption(entry.title)
+                    expected, uploaded = await upload_files(
+                        context, chat_id, result, status, caption, reply_to_msg_id,
+                        entry if format_id == AUDIO_FORMAT else None,
+                    )
+                    await remember_uploads(entry.url, format_id, expected, uploaded, caption)
+                    sent += 1
+                    status.update(f"📥 Downloading playlist: {sent}/{total} sent... Please wait.")
+
+        summary = f"✅ Playlist complete: {sent}/{total} videos sent! 🎥"
+        if failed:
+            summary += f"\n⚠️ {failed} could not be downloaded."
+        with timed("status"):
+            await status.finish(summary)
+    finally:
+        if not status.finished:
+            with timed("status"):
+                await status.finish()
+
+
+# Identical (URL, format) requests share one download + upload; the chats that
+# joined while it ran get the resulting file_ids instead of their own copy
+async def deliver(context, chat_id, url, format_id, metadata, caption=None, reply_to_msg_id=None):
+    key = (normalize_url(url), format_id or "")
+    _, shared = await downloads_in_flight.do(
+        key,
+        lambda: download_and_send(context, chat_id, url, format_id, metadata, caption, reply_to_msg_id),
+    )
+    if shared:
+        logger.info(f"Chat {chat_id} joined an in-flight download of {key}")
+        if await send_cached_files(context, chat_id, url, format_id, reply_to_msg_id):
+            await context.bot.send_message(chat_id, "✅ Download complete! 🎥")
+        else:
+            # The shared upload didn't fully succeed, fetch our own copy
+            await download_and_send(context, chat_id, url, format_id, metadata, caption, reply_to_msg_id)
+
+
+async def send_paused_message(context, chat_id, key, reply_to_msg_id=None):
+    retry_in = circuit_breakers.get(key).retry_in()
+    await context.bot.send_message(
+        chat_id,
+        "🚧 Downloads from this site are failing right now, so they're paused for a bit. "
+        f"Please try again in {max(1, round(retry_in / 60))} min.",
+        reply_to_message_id=reply_to_msg_id,
+    )
+
+
+async def handle_download_logic(chat_id, url, context, selected_format=None, reply_to_msg_id=None, metadata=None, user_id=None):
+    # Runs for a link a user sent (with their user_id) and again in a queue
+    # worker for the job that came of it. From a chat, anything that needs a
+    # download goes to the queue under that user; the worker does it.
+    breaker = None
+    failure = None
+    try:
+        # Already uploaded once? Telegram can re-send it instantly
+        if selected_format is not None:
+            with timed("cached_send"):
+                sent_from_cache = await send_cached_files(context, chat_id, url, selected_format, reply_to_msg_id)
+            if sent_from_cache:
+                await context.bot.send_message(chat_id, "✅ Download complete! 🎥")
+                return "cached"
+
+        # A site that keeps failing is paused instead of costing every user a doomed attempt
+        extractor = await run_io(extractor_for, url)
+        set_label("extractor", extractor)
+        key = breaker_key(url, extractor)
+        if not circuit_breakers.get(key).allow():
+            await send_paused_message(context, chat_id, key, reply_to_msg_id)
+            return "breaker_open"
+        breaker = circuit_breakers.get(key)
+
+        # One extraction per request; callers that already have it pass it in
+        if metadata is None:
+            with timed("extract"):
+                metadata = await with_retries(run_extraction, extract_metadata, url)
+            add_stage("parse", metadata.parse_seconds)  # part of extract, broken out
+        if metadata.is_playlist:
+            # Only audio mode carries over; a video quality can't apply to every entry
+            playlist_format = AUDIO_FORMAT if selected_format == AUDIO_FORMAT else None
+            if user_id is not None:
+                await enqueue_download(
+                    context, chat_id, user_id, url, playlist_format, reply_to_msg_id=reply_to_msg_id, metadata=metadata
+                )
+                return "queued"
+            await deliver_playlist(context, chat_id, url, metadata, playlist_format, reply_to_msg_id)
+            return "done"
+        sanitized_info = metadata.info
+        file_size = metadata.file_size or 0
         file_size_mb = file_size / (1024 * 1024)
-        duration_hms = format_time(get_duration(sanitized_info))
+        duration_hms = format_time(metadata.duration)
 
         # # Send video info
         # await send_video_info_message(
         #     context, chat_id, file_size_mb, duration_hms, "Calculating...", reply_to_msg_id
         # )
 
-        quality_options = get_video_formats(url)
-        thumbnail_url = sanitized_info.get("thumbnail")
+        quality_options = metadata.quality_options
+        thumbnail_url = metadata.thumbnail
 
         # ========== DEFAULT DOWNLOAD IF NO FORMATS ========== #
-        if not quality_options:
-            await context.bot.send_message(
-                chat_id, "⚠️ No available formats found, downloading the default video..."
-            )
-
-            # 📌 Pin Downloading...
-            pin_msg = await context.bot.send_message(chat_id, "📥 Downloading video... Please wait.")
-            await context.bot.pin_chat_message(chat_id, pin_msg.message_id)
+        if not quality_options and selected_format is None:
+            if await send_cached_files(context, chat_id, url, None, reply_to_msg_id):
+                await context.bot.send_message(chat_id, "✅ Download complete! 🎥")
+                return "cached"
 
-            file_paths = download(url, None)
-
-            # ✅ Unpin Downloading...
-            try:
-                await context.bot.unpin_chat_message(chat_id, pin_msg.message_id)
-                await pin_msg.delete()
-            except Exception as e:
-                logger.warning(f"Couldn't unpin/delete downloading message: {e}")
-
-            # 📌 Pin Sending...
-            send_pin_msg = await context.bot.send_message(chat_id, "📤 Sending video... Please wait.")
-            await context.bot.pin_chat_message(chat_id, send_pin_msg.message_id)
-
-            for file_path in file_paths:
-                try:
-                    with open(file_path, "rb") as file:
-                        await context.bot.send_video(
-                            chat_id=chat_id,
-                            video=file,
-                            supports_streaming=True,
-                            reply_to_message_id=reply_to_msg_id
-                        )
-                    os.remove(file_path)
-                except Exception as e:
-                    logger.exception(f"Error sending file {file_path}: {e}")
-                    await context.bot.send_message(chat_id, f"⚠️ Error sending the video.\n\n`{str(e)}`", parse_mode="Markdown")
-
-            # ✅ Unpin Sending...
-            try:
-                await context.bot.unpin_chat_message(chat_id, send_pin_msg.message_id)
-                await send_pin_msg.delete()
-            except Exception as e:
-                logger.warning(f"Couldn't unpin/delete sending message: {e}")
-
-            return
+            if user_id is not None:
+                await context.bot.send_message(
+                    chat_id, "⚠️ No available formats found, downloading the default video..."
+                )
+                await enqueue_download(
+                    context, chat_id, user_id, url, None, reply_to_msg_id=reply_to_msg_id, metadata=metadata
+                )
+                return "queued"
+            await deliver(context, chat_id, url, None, metadata, None, reply_to_msg_id)
+            return "done"
 
         # ========== IF USER NEEDS TO SELECT FORMAT ========== #
         if selected_format is None:
-            video_id = store_video_url(url)
+            video_id = await run_db(store_video_url, url)
             keyboard = [
                 [
                     InlineKeyboardButton(
-                        f"{q['label']} - {((q.get('filesize') or 0) / (1024 * 1024)):.2f} MB",
-                        callback_data=json.dumps({"video_id": video_id, "format_id": q["format_id"]}),
+                        f"{q['label']} - {format_size_label(q)}",
+                        callback_data=encode_quality(video_id, q["format_id"], index),
                     )
                 ]
-                for q in quality_options
+                for index, q in enumerate(quality_options)
             ]
+            if metadata.audio_option:
+                keyboard.append([
+                    InlineKeyboardButton(
+                        f"{metadata.audio_option['label']} - {format_size_label(metadata.audio_option)}",
+                        callback_data=encode_quality(video_id, AUDIO_FORMAT, len(quality_options)),
+                    )
+                ])
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             if thumbnail_url:
@@ -329,63 +599,45 @@ async def handle_download_logic(chat_id, url, context, selected_format=None, rep
                 await context.bot.send_message(
                     chat_id, "📥 Select the quality you want:", reply_markup=reply_markup
                 )
-            return
+            return "keyboard"
 
         # ========== FORMAT WAS SELECTED, START DOWNLOAD ========== #
-        pin_msg = await context.bot.send_message(chat_id, "📥 Downloading video... Please wait.")
-        await context.bot.pin_chat_message(chat_id, pin_msg.message_id)
-
-        file_paths = download(url, selected_format)
-
-        try:
-            await context.bot.unpin_chat_message(chat_id, pin_msg.message_id)
-            await pin_msg.delete()
-        except Exception as e:
-            logger.warning(f"Couldn't unpin/delete downloading message: {e}")
-
-        send_pin_msg = await context.bot.send_message(chat_id, "📤 Sending video... Please wait.")
-        await context.bot.pin_chat_message(chat_id, send_pin_msg.message_id)
-
-        title = sanitized_info.get("title", "Untitled")
-        words = title.split()
-        short_title = " ".join(words[:10]) + "..." if len(words) > 10 else title
-        caption = f"{short_title} downloaded by @offeyicialBot"
-
-        for file_path in file_paths:
-            try:
-                with open(file_path, "rb") as file:
-                    await context.bot.send_video(
-                        chat_id=chat_id,
-                        video=file,
-                        supports_streaming=True,
-                        caption=caption,
-                        reply_to_message_id=reply_to_msg_id
-                    )
-                os.remove(file_path)
-            except Exception as e:
-                logger.exception(f"Error sending file {file_path}: {e}")
-                await context.bot.send_message(chat_id, f"⚠️ Error sending the video.\n\n`{str(e)}`", parse_mode="Markdown")
-        try:
-            await context.bot.unpin_chat_message(chat_id, send_pin_msg.message_id)
-            await send_pin_msg.delete()
-        except Exception as e:
-            logger.warning(f"Couldn't unpin/delete sending message: {e}")
-
-        await context.bot.send_message(chat_id, "✅ Download complete! 🎥")
+        caption = make_caption(metadata.title)
+
+        # The job's status message ends on "Download complete"
+        await deliver(context, chat_id, url, selected_format, metadata, caption, reply_to_msg_id)
+        return "done"
+
+    except BusyError as e:
+        logger.warning(f"Rejecting job for chat {chat_id}: {e}")
+        if breaker is not None:
+            breaker.release()  # says nothing about the site
+            breaker = None
+        await context.bot.send_message(chat_id, BUSY_MESSAGE)
+        return "busy"
+
+    except PlaylistTooLarge as e:
+        logger.info(f"Refused playlist {url}: {e}")
+        await context.bot.send_message(chat_id, str(e), reply_to_message_id=reply_to_msg_id)
+        return "too_large"
+
+    except FileTooLargeError as e:
+        logger.info(f"Aborted oversize download of {url}: {e}")
+        await context.bot.send_message(chat_id, TOO_LARGE_MESSAGE, reply_to_message_id=reply_to_msg_id)
+        return "too_large"
 
     except Exception as e:
-        error_text = str(e)
-        if "HTTP Error 423" in error_text:
-            message = "🚫 This video is locked or unavailable in your region."
-        elif "HTTP Error 404" in error_text:
-            message = "❌ The video link is invalid or has been removed."
-        elif "HTTP Error 403" in error_text:
-            message = "🚫 Access denied. The site may require login or region access."
-        else:
-            message = f"⚠️ Download failed: `{error_text}`"
-
-        logger.exception(f"Error during download: {message}")
-        await context.bot.send_message(chat_id, message, parse_mode="Markdown")
+        # Stale signed stream URLs are a common cause; don't serve them again
+        invalidate_metadata(url)
+        failure = classify(e)
+        set_label("failure", failure.kind)
+        logger.exception(f"Error during download ({failure.kind}): {e}")
+        await context.bot.send_message(chat_id, failure.message, parse_mode="Markdown")
+        return "failed"
+
+    finally:
+        if breaker is not None:
+            breaker.record(failure)
 
 async def download_media(update: Update, context: CallbackContext, override_url=None, reply_to_msg_id=None) -> None:
     chat_id = update.effective_chat.id
@@ -402,10 +654,13 @@ async def download_media(update: Update, context: CallbackContext, override_url=
         await context.bot.send_message(chat_id, cleaning_tip)
 
     # Handle the download logic
-    await handle_download_logic(
+    job_metrics = begin_job(user_id=update.effective_user.id, chat_id=chat_id, url=url, format_id=None)
+    outcome = await handle_download_logic(
     chat_id, url, context, 
-    reply_to_msg_id=reply_to_msg_id or update.message.message_id
+    reply_to_msg_id=reply_to_msg_id or update.message.message_id,
+    user_id=update.effective_user.id,
     )
+    await end_job(job_metrics, outcome)
 
 
 
@@ -418,15 +673,29 @@ async def download_command(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("⚠️ Usage: /download <URL>")
 
 
+async def audio_command(update: Update, context: CallbackContext) -> None:
+    if not context.args:
+        await update.message.reply_text("⚠️ Usage: /audio <URL>")
+        return
+
+    url = context.args[0].strip()
+    if not url.startswith(("http://", "https://")):
+        await update.message.reply_text("⚠️ Please send a valid URL")
+        return
+
+    # Same path as the keyboard's "Audio only" button
+    await enqueue_download(
+        context, update.effective_chat.id, update.effective_user.id, url, AUDIO_FORMAT,
+        reply_to_msg_id=update.message.message_id,
+    )
+
+
 async def quality_selection(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
 
     try:
-        # Decode JSON data safely
-        data = json.loads(query.data)
-        video_id = data["video_id"]
-        selected_format = data["format_id"]
-    except (json.JSONDecodeError, KeyError):
+        video_id, selected_format, format_index = decode_quality(query.data)
+    except (ValueError, KeyError):
         await query.answer("⚠️ Invalid selection.", show_alert=True)
         return
 
@@ -434,7 +703,7 @@ async def quality_selection(update: Update, context: CallbackContext) -> None:
 
     chat_id = query.message.chat_id
     user_id = query.from_user.id
-    url = get_video_url(video_id)  # Retrieve the original URL from the DB
+    url = await run_db(get_video_url, video_id)  # Retrieve the original URL from the DB
 
     if not url:
         await context.bot.send_message(chat_id, "⚠️ Error: Video not found.")
@@ -442,30 +711,83 @@ async def quality_selection(update: Update, context: CallbackContext) -> None:
 
     # Add the user request to the queue
     reply_to_msg_id = update.callback_query.message.message_id
-    # Fetch available formats again to get file size
-    formats = get_video_formats(url)
-    chosen_format = next((f for f in formats if f["format_id"] == selected_format), None)
+    await enqueue_download(context, chat_id, user_id, url, selected_format, format_index, reply_to_msg_id)
+
+
+async def enqueue_download(context, chat_id, user_id, url, selected_format, format_index=None, reply_to_msg_id=None, metadata=None):
+    # Shared by the quality keyboard, /audio, playlists and links without
+    # formats (selected_format None, no index: the default): cache, breaker
+    # and size checks up front, then the durable queue does the work
+
+    # Someone already got this exact file: deliver it now and skip the queue
+    if format_index is None and await send_cached_files(
+        context, chat_id, url, selected_format, reply_to_msg_id
+    ):
+        await context.bot.send_message(chat_id, "✅ Download complete! 🎥")
+        return
+
+    # Don't queue jobs for a paused site (the worker would refuse them anyway)
+    key = breaker_key(url, await run_io(extractor_for, url))
+    if circuit_breakers.get(key).state == STATE_OPEN and circuit_breakers.get(key).retry_in() > 0:
+        await send_paused_message(context, chat_id, key, reply_to_msg_id)
+        return
+
+    # Extract once here; the same metadata rides along in the queue to the download
+    if metadata is None:
+        try:
+            metadata = await with_retries(run_extraction, extract_metadata, url)
+        except BusyError as e:
+            logger.warning(f"Rejecting selection for chat {chat_id}: {e}")
+            await context.bot.send_message(chat_id, BUSY_MESSAGE, reply_to_message_id=reply_to_msg_id)
+            return
+
+    if metadata.is_playlist:
+        # Refuse an oversize playlist now rather than after its turn in the queue
+        try:
+            check_entry_count(metadata)
+        except PlaylistTooLarge as e:
+            await context.bot.send_message(chat_id, str(e), reply_to_message_id=reply_to_msg_id)
+            return
+    elif selected_format is None and format_index is not None:
+        # Long format ids travel as their index in the keyboard
+        if format_index >= len(metadata.quality_options):
+            await context.bot.send_message(chat_id, "⚠️ This quality is no longer available, please send the link again.")
+            return
+        selected_format = metadata.quality_options[format_index]["format_id"]
+    chosen_format = metadata.find_format(selected_format)
 
     if chosen_format:
-        size_bytes = chosen_format.get("filesize") or 0
-        size_mb = size_bytes / (1024 * 1024)
+        size_bytes = chosen_format.get("filesize")
+        if chosen_format.get("size_confidence") == CONFIDENCE_UNKNOWN:
+            # No size or bitrate from the site: ask the CDN before committing
+            raw_format = metadata.raw_format(selected_format)
+            try:
+                size_bytes = await run_extraction(probe_format_size, raw_format) if raw_format else None
+            except BusyError:
+                size_bytes = None  # the mid-download cap still protects us
+            logger.info(f"Probed size of {url} [{selected_format}]: {size_bytes}")
 
-        if size_mb > 50:
+        if (size_bytes or 0) > FREE_SIZE_LIMIT:
             await context.bot.send_message(
                 chat_id=chat_id,
-                text="🔒 This format is larger than 50MB and only available to Premium users.\nUpgrade to download. /upgrade",
+                text=TOO_LARGE_MESSAGE,
                 reply_to_message_id=reply_to_msg_id
             )
             return
 
     # Proceed to queue if size is fine
-    await queue.put((chat_id, user_id, url, selected_format, reply_to_msg_id))
-
-
-    queue_positions[chat_id] = queue.qsize()  # Assign a unique position
+    job = Job(chat_id, user_id, url, selected_format, reply_to_msg_id, metadata)
+    try:
+        queue_position = await queue.put(job)
+    except QueueFullError:
+        await context.bot.send_message(
+            chat_id,
+            "⏳ You already have several downloads waiting. Please wait for them to finish first.",
+            reply_to_message_id=reply_to_msg_id
+        )
+        return
 
     # Notify the user of their queue position
-    queue_position = queue_positions[chat_id]
     await context.bot.send_message(
         chat_id,
         f"📥 Your request has been added to the queue. Your position: {queue_position}. Please wait..."
@@ -481,6 +803,7 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "/about - Information about the bot and its features\n"
         "/donate - Support development and maintenance\n"
         "/download <url> - Instantly download media using a direct URL\n"
+        "/audio <url> - Download just the audio as m4a/mp3\n"
         "/help - Show this help message\n\n"
         "*🎯 To Download Media:*\n"
         "Just send a direct video or audio link in the chat. The bot will analyze it and let you choose the quality to download.\n\n"
@@ -499,8 +822,9 @@ async def help_command(update: Update, context: CallbackContext) -> None:
 async def send_logs_to_owner(context: CallbackContext) -> None:
     owner_id = int(os.getenv("OWNER_ID"))
 
-    # Send videos.db
+    # Send videos.db (checkpoint first so the WAL contents are in the file)
     if os.path.exists("videos.db"):
+        await run_db(checkpoint)
         with open("videos.db", "rb") as db_file:
             await context.bot.send_document(chat_id=owner_id, document=db_file, caption="📄 videos.db")
 
@@ -520,6 +844,133 @@ async def send_data_command(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("🚫 You are not authorized to use this command.")
 
 
+async def cache_stats_command(update: Update, context: CallbackContext) -> None:
+    owner_id = int(os.getenv("OWNER_ID"))
+    if update.effective_user.id != owner_id:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    stats = metadata_cache.stats()
+    await update.message.reply_text(
+        "🗂 Metadata cache\n"
+        f"Entries: {stats['size']}/{stats['max_entries']} (TTL {stats['ttl']}s)\n"
+        f"Hits: {stats['hits']}  Misses: {stats['misses']}  Hit rate: {stats['hit_rate']:.0%}\n"
+        f"Evictions: {stats['evictions']}  Expirations: {stats['expirations']}"
+    )
+
+
+async def export_log_command(update: Update, context: CallbackContext) -> None:
+    owner_id = int(os.getenv("OWNER_ID"))
+    if update.effective_user.id != owner_id:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    # Built from logs/job_metrics.jsonl on request; nothing writes xlsx per job
+    path = await run_io(export_xlsx, log_file_path)
+    with open(path, "rb") as log_file:
+        await context.bot.send_document(chat_id=owner_id, document=log_file, caption="📊 Upload Log")
+
+
+async def collect_runtime_metrics():
+    for status, count in (await queue.counts()).items():
+        telemetry.queue_jobs.set(count, status=status)
+    for pool in (extract_pool, download_pool):
+        telemetry.pool_pending.set(pool.pending, pool=pool.name)
+        telemetry.pool_limit.set(pool.limit, pool=pool.name)
+    stats = metadata_cache.stats()
+    telemetry.cache_entries.set(stats["size"])
+    telemetry.cache_hit_ratio.set(round(stats["hit_rate"], 4))
+    limiter = rate_limiter.stats()
+    for priority, count in limiter["pending"].items():
+        telemetry.limiter_pending.set(count, priority=priority)
+    telemetry.limiter_oldest_wait.set(round(limiter["oldest_wait"], 3))
+    telemetry.limiter_blocked_chats.set(limiter["blocked_chats"])
+    telemetry.limiter_retry_afters.set(limiter["retry_afters"])
+    # Only breakers that still exist (healthy ones get forgotten)
+    for gauge in (telemetry.breaker_state, telemetry.breaker_failure_rate, telemetry.breaker_rejected):
+        gauge.values.clear()
+    for key, breaker in circuit_breakers.stats().items():
+        telemetry.breaker_state.set(BREAKER_STATE_CODES[breaker["state"]], site=key)
+        telemetry.breaker_failure_rate.set(round(breaker["failure_rate"], 4), site=key)
+        telemetry.breaker_rejected.set(breaker["rejected"], site=key)
+    disk = await run_io(scratch_usage)
+    telemetry.scratch_used.set(disk["used"])
+    telemetry.scratch_free.set(disk["free"])
+    telemetry.scratch_quota.set(disk["quota"])
+
+
+MB = 1024 * 1024
+BREAKER_STATE_CODES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    owner_id = int(os.getenv("OWNER_ID"))
+    if update.effective_user.id != owner_id:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    # Same numbers as the /metrics endpoint, for this process since it started
+    await collect_runtime_metrics()
+    outcomes = {}
+    for (_, outcome), count in telemetry.jobs_total.values.items():
+        outcomes[outcome] = outcomes.get(outcome, 0) + count
+    api_calls = telemetry.job_api_calls.merged()
+    jobs = sum(api_calls[:-1])
+    queued = ", ".join(f"{status} {count}" for (status,), count in sorted(telemetry.queue_jobs.values.items()))
+    instances = ydl_pool.stats()
+
+    lines = [
+        "📈 Bot stats",
+        f"Jobs: {', '.join(f'{outcome} {count}' for outcome, count in sorted(outcomes.items())) or 'none yet'}",
+        f"Queue: {queued or 'empty'}",
+        f"Workers busy: {telemetry.workers_busy.values.get((), 0)}/{telemetry.workers_total.values.get((), 0)}",
+        f"API calls per job: {api_calls[-1] / jobs:.1f}" if jobs else "API calls per job: -",
+        f"Send queue: {', '.join(f'{name} {count}' for (name,), count in sorted(telemetry.limiter_pending.values.items()))}"
+        f" (oldest {telemetry.limiter_oldest_wait.values.get((), 0):.1f}s,"
+        f" {telemetry.limiter_blocked_chats.values.get((), 0)} chats in flood wait,"
+        f" {telemetry.limiter_retry_afters.values.get((), 0)} 429s)",
+        f"Scratch: {telemetry.scratch_used.values.get((), 0) / MB:.0f} MB used"
+        f" of {telemetry.scratch_quota.values.get((), 0) / MB:.0f} MB quota,"
+        f" {telemetry.scratch_free.values.get((), 0) / MB:.0f} MB free on disk",
+        f"yt-dlp instances: {instances['created']} created, {instances['reused']} reuses, {instances['idle']} idle",
+        f"Paused sites: {', '.join(name for name, b in circuit_breakers.stats().items() if b['state'] != STATE_CLOSED) or 'none'}",
+        "",
+        "⏱ Stage latency (p50 / p95)",
+    ]
+    for stage in telemetry.stage_seconds.label_values("stage"):
+        p50 = telemetry.stage_seconds.quantile(0.5, stage=stage)
+        p95 = telemetry.stage_seconds.quantile(0.95, stage=stage)
+        lines.append(f"{stage}: {format_seconds(p50)} / {format_seconds(p95)}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def breakers_command(update: Update, context: CallbackContext) -> None:
+    owner_id = int(os.getenv("OWNER_ID"))
+    if update.effective_user.id != owner_id:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    # Circuits of this process (extractor, or Generic:<host>); only sites that had jobs show up
+    lines = ["🚧 Circuit breakers"]
+    for key, breaker in circuit_breakers.stats().items():
+        line = (
+            f"{key}: {breaker['state']}, {breaker['failure_rate']:.0%} of last {breaker['calls']} failed,"
+            f" tripped {breaker['trips']}x, {breaker['rejected']} jobs refused"
+        )
+        if breaker["state"] == STATE_OPEN:
+            line += f", retry in {breaker['retry_in']:.0f}s"
+        if breaker["last_failure"]:
+            line += f" (last: {breaker['last_failure']})"
+        lines.append(line)
+    if len(lines) == 1:
+        lines.append("No sites tried yet.")
+    await update.message.reply_text("\n".join(lines))
+
+
 async def error_handler(update: object, context: CallbackContext) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
     if update and isinstance(update, Update):
@@ -529,16 +980,31 @@ async def error_handler(update: object, context: CallbackContext) -> None:
         )
 
 
-async def process_queue(context: CallbackContext):
+async def process_queue(context: CallbackContext, worker_id=0):
+    worker_name = f"{socket.gethostname()}-{os.getpid()}-{worker_id}"
     while True:
-        chat_id, user_id, url, selected_format, reply_to_msg_id = await queue.get()
-
+        await wait_for_room()
+        job = await queue.get(worker_name)
+        logger.info(f"Worker {worker_name} picked job {job.id} for user {job.user_id}")
+
+        lease = asyncio.create_task(queue.keep_leased(job))
+        job_metrics = begin_job(
+            job_id=job.id, user_id=job.user_id, chat_id=job.chat_id, url=job.url, format_id=job.format_id,
+            worker=worker_name, queued_s=round(time.time() - job.enqueued_at, 3) if job.enqueued_at else None,
+        )
+        outcome, error = "failed", None
         try:
-            await handle_download_logic(chat_id, url, context, selected_format, reply_to_msg_id)
+            with WorkerGauge():
+                outcome = await handle_download_logic(
+                    job.chat_id, job.url, context, job.format_id, job.reply_to_msg_id, job.metadata
+                )
+        except Exception as e:
+            error = str(e)
+            logger.exception(f"Worker {worker_name} failed job {job.id}: {e}")
         finally:
-            queue.task_done()
-            if chat_id in queue_positions:
-                del queue_positions[chat_id]
+            lease.cancel()
+            await queue.task_done(job, outcome, error)
+            await end_job(job_metrics, outcome)
 
 async def upgrade(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(
@@ -551,18 +1017,65 @@ async def upgrade(update: Update, context: CallbackContext) -> None:
 
 
 
-async def run_bot():
-    init_db()
+async def on_initialized(app):
+    startup_timer.mark("initialized")
+    if BOT_MODE == "webhook":
+        startup_timer.mark("ready")  # the webhook server starts right after this
+
 
-    app = (
+async def warm_up_downloader():
+    # /start, /help and /about don't need yt-dlp; load it off the event loop
+    # so the first link a user sends doesn't pay for the import either
+    try:
+        await run_io(warm_up)
+        startup_timer.mark("warm_up")
+    except Exception as e:
+        logger.warning(f"yt-dlp warm-up failed: {e}")
+
+
+def build_application():
+    return (
         ApplicationBuilder()
         .token(BOT_TOKEN)
-        .read_timeout(300)
-        .connect_timeout(300)
+        # Point at a local Bot API server (or a test stand-in) when set
+        .base_url(os.getenv("BOT_API_URL", "https://api.telegram.org/bot"))
+        # Counts Bot API calls per method and per job for the metrics endpoint
+        .request(CountingRequest(connection_pool_size=256, read_timeout=300, connect_timeout=300))
+        .get_updates_request(TimedUpdatesRequest())
+        # Handlers await the executor pools, so let updates run side by side
+        .concurrent_updates(int(os.getenv("CONCURRENT_UPDATES", 64)))
+        .rate_limiter(rate_limiter)
+        .post_init(on_initialized)
         .build()
     )
-    await app.bot.delete_webhook(drop_pending_updates=True)  # 🧨 Required for polling
-    asyncio.create_task(process_queue(app))
+
+
+async def run_bot():
+    if BOT_MODE not in ("polling", "webhook"):
+        raise SystemExit(f"BOT_MODE must be 'polling' or 'webhook', not {BOT_MODE!r}")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_URL")
+    # Without the secret anyone who finds the URL can post fake updates
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_SECRET")
+    if BOT_MODE == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        raise SystemExit("WEBHOOK_SECRET may only use A-Z, a-z, 0-9, _ and - (up to 256 characters)")
+
+    init_db()
+    await run_io(sweep_orphans)
+
+    app = build_application()
+    if BOT_MODE == "polling":
+        await app.bot.delete_webhook(drop_pending_updates=True)  # 🧨 Required for polling
+    asyncio.create_task(maintenance_loop())
+    asyncio.create_task(flush_loop())
+    asyncio.create_task(warm_up_downloader())
+    await start_metrics_server()
+    telemetry.collectors.append(collect_runtime_metrics)
+    telemetry.workers_total.set(QUEUE_WORKERS)
+    telemetry.workers_busy.set(0)
+    for worker_id in range(QUEUE_WORKERS):
+        asyncio.create_task(process_queue(app, worker_id))
     app.add_handler(
         CommandHandler(
             "start", start, filters=filters.ChatType.GROUPS | filters.ChatType.PRIVATE
@@ -601,9 +1114,20 @@ async def run_bot():
             filters=filters.ChatType.GROUPS | filters.ChatType.PRIVATE,
         )
     )
+    app.add_handler(
+        CommandHandler(
+            "audio",
+            audio_command,
+            filters=filters.ChatType.GROUPS | filters.ChatType.PRIVATE,
+        )
+    )
 
-    app.add_handler(CallbackQueryHandler(quality_selection))
+    app.add_handler(CallbackQueryHandler(quality_selection, pattern=QUALITY_PATTERN))
     app.add_handler(CommandHandler("sendfiles", send_data_command))
+    app.add_handler(CommandHandler("cachestats", cache_stats_command))
+    app.add_handler(CommandHandler("exportlog", export_log_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("breakers", breakers_command))
 
     app.add_handler(CallbackQueryHandler(button))
     app.add_handler(
@@ -611,7 +1135,19 @@ async def run_bot():
     )
     app.add_error_handler(error_handler)
 
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        # Any number of bot processes can sit behind a load balancer on WEBHOOK_URL
+        logger.info(f"Starting webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
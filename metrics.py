@@ -0,0 +1,170 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from telemetry import observe_job
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = os.getenv("METRICS_PATH", "logs/job_metrics.jsonl")
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", 20))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 10))
+
+# Column names of the old upload_log.xlsx, kept for the owner's spreadsheet
+XLSX_COLUMNS = {
+    "user_id": "User",
+    "bytes": "File Size",
+    "download_s": "Download Time",
+    "upload_s": "Upload Time",
+    "total_s": "Total Time",
+    "speed_bps": "Speed",
+}
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobMetrics:
+    def __init__(self, **labels):
+        self.labels = labels
+        self.stages = {}
+        self.bytes = 0
+        self.api_calls = 0
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def to_record(self, outcome):
+        total = time.perf_counter() - self.started
+        transfer = self.stages.get("download", 0.0) + self.stages.get("upload", 0.0) + self.stages.get("stream", 0.0)
+        record = {
+            "ts": time.time(),
+            **self.labels,
+            "outcome": outcome,
+            "bytes": self.bytes,
+            "api_calls": self.api_calls,
+            "total_s": round(total, 3),
+            "speed_bps": round(self.bytes / transfer) if transfer else None,
+        }
+        for stage, seconds in self.stages.items():
+            record[f"{stage}_s"] = round(seconds, 3)
+        return record
+
+
+class MetricsSink:
+    # Append-only JSONL file, written in batches. One line per job; several
+    # processes can append to the same file since each batch is one write.
+    def __init__(self, path, batch_size):
+        self.path = path
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            return len(self._buffer) >= self.batch_size
+
+    def flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with open(self.path, "a", encoding="utf-8") as metrics_file:
+            metrics_file.write(data)
+
+    def read(self):
+        self.flush()
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as metrics_file:
+            return [json.loads(line) for line in metrics_file if line.strip()]
+
+
+sink = MetricsSink(METRICS_PATH, METRICS_BATCH_SIZE)
+atexit.register(sink.flush)
+
+
+def begin_job(**labels):
+    metrics = JobMetrics(**labels)
+    _current_job.set(metrics)
+    return metrics
+
+
+async def end_job(metrics, outcome):
+    record = metrics.to_record(outcome)
+    observe_job(record, metrics.stages)
+    if sink.append(record):
+        await asyncio.to_thread(sink.flush)
+
+
+@contextmanager
+def timed(stage):
+    # Adds the block's wall time to the current job's stage, if any
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current_job.get()
+        if metrics is not None:
+            metrics.add(stage, time.perf_counter() - started)
+
+
+def get_label(name):
+    metrics = _current_job.get()
+    return metrics.labels.get(name) if metrics is not None else None
+
+
+def set_label(name, value):
+    metrics = _current_job.get()
+    if metrics is not None:
+        metrics.labels[name] = value
+
+
+def add_stage(stage, seconds):
+    metrics = _current_job.get()
+    if metrics is not None and seconds:
+        metrics.add(stage, seconds)
+
+
+def add_api_call():
+    metrics = _current_job.get()
+    if metrics is not None:
+        metrics.api_calls += 1
+
+
+def add_bytes(count):
+    metrics = _current_job.get()
+    if metrics is not None and count:
+        metrics.bytes += count
+
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(sink.flush)
+        except Exception as e:
+            logger.exception(f"Flushing metrics failed: {e}")
+
+
+def export_xlsx(path):
+    # pandas/openpyxl are only needed here, so they are imported on demand
+    import pandas as pd
+
+    df = pd.DataFrame(sink.read())
+    if df.empty:
+        df = pd.DataFrame(columns=list(XLSX_COLUMNS.values()))
+    else:
+        df = df.rename(columns=XLSX_COLUMNS)
+        df["ts"] = pd.to_datetime(df["ts"], unit="s")
+    df.to_excel(path, index=False)
+    return path
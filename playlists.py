@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+
+from executors import BusyError, extract_pool, run_download, run_extraction
+from failures import with_retries
+from metrics import timed
+from utils import download, extract_metadata
+
+logger = logging.getLogger(__name__)
+
+# Checked before any media is fetched: the entry count from the flat
+# playlist, the total from each entry's size estimate
+PLAYLIST_MAX_ENTRIES = int(os.getenv("PLAYLIST_MAX_ENTRIES", 25))
+PLAYLIST_MAX_TOTAL = int(os.getenv("PLAYLIST_MAX_TOTAL_MB", 1024)) * 1024 * 1024
+PLAYLIST_PARALLEL = int(os.getenv("PLAYLIST_PARALLEL", 2))  # entries downloading at once
+
+
+class PlaylistTooLarge(Exception):
+    pass
+
+
+def entry_url(entry):
+    # Flat entries are url stubs; some extractors only fill in webpage_url
+    return entry.get("url") or entry.get("webpage_url")
+
+
+def check_entry_count(metadata, max_entries=PLAYLIST_MAX_ENTRIES):
+    count = len(metadata.entries)
+    if max_entries and count > max_entries:
+        raise PlaylistTooLarge(f"📚 This playlist has {count} videos, the limit is {max_entries}.")
+    return count
+
+
+async def resolve_entries(metadata):
+    # Full extraction of each entry (formats, sizes), no media yet. Returns
+    # [(position, VideoMetadata)]; entries that fail to resolve are left out.
+    entries = metadata.entries
+    # Keep within the extraction pool's backlog so other users aren't told "busy"
+    gate = asyncio.Semaphore(extract_pool.workers)
+
+    async def resolve(position, entry):
+        async with gate:
+            try:
+                resolved = await run_extraction(extract_metadata, entry_url(entry))
+            except BusyError:
+                raise
+            except Exception as e:
+                logger.warning(f"Skipping playlist entry {position} ({entry_url(entry)}): {e}")
+                return None
+        if resolved.is_playlist:
+            logger.warning(f"Skipping nested playlist at entry {position} ({resolved.url})")
+            return None
+        return position, resolved
+
+    results = await asyncio.gather(*(resolve(position, entry) for position, entry in enumerate(entries, start=1)))
+    return [result for result in results if result is not None]
+
+
+def check_total_size(entries, max_total=PLAYLIST_MAX_TOTAL):
+    estimated = sum(metadata.file_size or 0 for _, metadata in entries)
+    if max_total and estimated > max_total:
+        raise PlaylistTooLarge(
+            f"📚 This playlist is about {estimated / (1024 * 1024):.0f} MB, "
+            f"the limit is {max_total / (1024 * 1024):.0f} MB."
+        )
+    return estimated
+
+
+async def download_entries(entries, output_dir, format_id=None, max_filesize=None, parallel=PLAYLIST_PARALLEL, max_total=PLAYLIST_MAX_TOTAL):
+    # Downloads up to `parallel` entries at a time and yields
+    # (position, metadata, file_paths or exception) in the order they finish,
+    # so the caller can upload one entry while the next is still downloading.
+    # Estimates can be missing or low, so the real total is checked too.
+    finished = asyncio.Queue()
+    gate = asyncio.Semaphore(parallel)
+
+    async def fetch(position, metadata):
+        async with gate:
+            try:
+                with timed("download"):
+                    result = await with_retries(
+                        run_download, download, metadata.url, format_id, metadata, max_filesize, None, output_dir
+                    )
+            except Exception as e:
+                result = e
+        finished.put_nowait((position, metadata, result))
+
+    tasks = [asyncio.create_task(fetch(position, metadata)) for position, metadata in entries]
+    fetched = 0
+    try:
+        for _ in tasks:
+            position, metadata, result = await finished.get()
+            if not isinstance(result, Exception):
+                # Measured before the caller uploads (and removes) the files
+                fetched += await asyncio.to_thread(sum, (os.path.getsize(path) for path in result))
+            yield position, metadata, result
+            if max_total and fetched > max_total:
+                raise PlaylistTooLarge(
+                    f"📚 Stopped after {fetched / (1024 * 1024):.0f} MB, "
+                    f"the playlist limit is {max_total / (1024 * 1024):.0f} MB."
+                )
+    finally:
+        # Closed early (limit, error, cancelled job): drop what hasn't started
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,92 @@
+import json
+import os
+import random
+import shutil
+
+MB = 1024 * 1024
+
+# Download engine knobs, one profile per kind of site. Keys mirror the
+# yt-dlp options they map to in ydl_options_for().
+PROFILES = {
+    "default": {
+        "concurrent_fragments": 4,
+        "http_chunk_size": 10 * MB,
+        "buffer_size": 1 * MB,
+        "retries": 5,
+        "fragment_retries": 10,
+        "backoff_base": 1.0,
+        "backoff_max": 30.0,
+        "external_downloader": None,
+    },
+    # HLS/DASH heavy sites: fragments are the bottleneck, fetch many at once
+    "fragmented": {
+        "concurrent_fragments": 8,
+        "http_chunk_size": None,
+        "buffer_size": 1 * MB,
+        "retries": 5,
+        "fragment_retries": 20,
+        "backoff_base": 0.5,
+        "backoff_max": 15.0,
+        "external_downloader": None,
+    },
+    # Single big progressive files from CDNs that allow parallel ranges
+    "aria2c": {
+        "concurrent_fragments": 4,
+        "http_chunk_size": None,
+        "buffer_size": 1 * MB,
+        "retries": 5,
+        "fragment_retries": 10,
+        "backoff_base": 1.0,
+        "backoff_max": 30.0,
+        "external_downloader": "aria2c",
+        "external_downloader_args": ["-x", "8", "-s", "8", "-k", "1M", "--file-allocation=none"],
+    },
+}
+
+# yt-dlp extractor_key -> profile name
+EXTRACTOR_PROFILES = {
+    "Youtube": "default",  # 10 MB chunks sidestep YouTube's per-request throttling
+    "Twitch": "fragmented",
+    "TwitchVod": "fragmented",
+    "Vimeo": "fragmented",
+    "Dailymotion": "fragmented",
+    "Generic": "default",
+}
+
+# e.g. DOWNLOAD_PROFILES='{"fragmented": {"concurrent_fragments": 16}}'
+for _name, _overrides in json.loads(os.getenv("DOWNLOAD_PROFILES", "{}")).items():
+    PROFILES[_name] = {**PROFILES.get(_name, PROFILES["default"]), **_overrides}
+# e.g. EXTRACTOR_PROFILES='{"Instagram": "aria2c"}'
+EXTRACTOR_PROFILES.update(json.loads(os.getenv("EXTRACTOR_PROFILES", "{}")))
+
+
+def profile_name_for(extractor_key):
+    return EXTRACTOR_PROFILES.get(extractor_key or "", "default")
+
+
+def backoff(base, cap):
+    # Full-jitter exponential backoff, the shape yt-dlp's retry_sleep_functions expects
+    def sleep_for(n):
+        return random.uniform(0, min(cap, base * (2 ** n)))
+    return sleep_for
+
+
+def ydl_options_for(extractor_key=None, profile_name=None):
+    name = profile_name or profile_name_for(extractor_key)
+    profile = PROFILES.get(name, PROFILES["default"])
+    sleep_for = backoff(profile["backoff_base"], profile["backoff_max"])
+    options = {
+        "concurrent_fragment_downloads": profile["concurrent_fragments"],
+        "buffersize": profile["buffer_size"],
+        "retries": profile["retries"],
+        "fragment_retries": profile["fragment_retries"],
+        "retry_sleep_functions": {"http": sleep_for, "fragment": sleep_for},
+    }
+    if profile.get("http_chunk_size"):
+        options["http_chunk_size"] = profile["http_chunk_size"]
+    downloader = profile.get("external_downloader")
+    if downloader and shutil.which(downloader):
+        # Only for plain http(s); yt-dlp keeps its native HLS/DASH downloaders
+        options["external_downloader"] = {"http": downloader}
+        options["external_downloader_args"] = {downloader: profile.get("external_downloader_args", [])}
+    return options
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+PIN_STATUS = os.getenv("PIN_STATUS", "0") == "1"
+# At most one edit per chat per this many seconds; newer text replaces older
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", 3))
+HOOK_INTERVAL = 0.5  # how often a download thread hands progress to the loop
+
+_last_edit = {}  # chat_id -> monotonic time of the last edit, shared by all jobs in the chat
+
+
+def _forget_old_edits(now, interval):
+    # An edit older than the interval no longer delays anything; entries
+    # pushed into the future by a flood wait stay until they expire
+    for chat_id in [c for c, at in _last_edit.items() if now - at > interval]:
+        del _last_edit[chat_id]
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def describe_progress(status):
+    # One status line from a yt-dlp progress dict
+    downloaded = status.get("downloaded_bytes") or 0
+    total = status.get("total_bytes") or status.get("total_bytes_estimate")
+    parts = []
+    if total:
+        parts.append(f"{min(downloaded / total, 1):.0%} of {'~' if not status.get('total_bytes') else ''}{format_bytes(total)}")
+    else:
+        parts.append(format_bytes(downloaded))
+    if status.get("speed"):
+        parts.append(f"{format_bytes(status['speed'])}/s")
+    if status.get("eta") is not None:
+        parts.append(f"ETA {format_eta(status['eta'])}")
+    return "📥 Downloading... " + " · ".join(parts)
+
+
+class StatusMessage:
+    # The one message a job shows the user, edited in place as it moves
+    # from downloading to sending to done
+    def __init__(self, bot, chat_id, reply_to_msg_id=None, pin=PIN_STATUS, interval=STATUS_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_msg_id = reply_to_msg_id
+        self.pin = pin
+        self.interval = interval
+        self.message = None
+        self.shown = None
+        self.pending = None
+        self.finished = False
+        self._flusher = None
+
+    async def start(self, text):
+        self.message = await self.bot.send_message(self.chat_id, text, reply_to_message_id=self.reply_to_msg_id)
+        self.shown = text
+        _last_edit[self.chat_id] = time.monotonic()
+        if self.pin:
+            try:
+                await self.bot.pin_chat_message(self.chat_id, self.message.message_id, disable_notification=True)
+            except TelegramError as e:
+                logger.warning(f"Couldn't pin status message in chat {self.chat_id}: {e}")
+                self.pin = False
+
+    def update(self, text):
+        # Cheap and non-blocking: only the newest text is kept, and a single
+        # task sends it once the chat's edit interval has passed
+        if self.message is None or text == self.shown:
+            return
+        self.pending = text
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self.pending is not None:
+            wait = _last_edit.get(self.chat_id, 0) + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text, self.pending = self.pending, None
+            _forget_old_edits(time.monotonic(), max(self.interval, STATUS_EDIT_INTERVAL))
+            await self._edit(text)
+
+    async def _edit(self, text, final=False):
+        if text == self.shown:
+            return
+        _last_edit[self.chat_id] = time.monotonic()
+        try:
+            await self.message.edit_text(text)
+            self.shown = text
+        except RetryAfter as e:
+            # Progress is cosmetic: skip this one and let the next edit wait longer.
+            # The rate limiter drops edits on flood control, so the final state
+            # waits it out here and goes once more.
+            _last_edit[self.chat_id] = time.monotonic() + e.retry_after
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Couldn't edit status message in chat {self.chat_id}: {e}")
+        except TelegramError as e:
+            logger.warning(f"Couldn't edit status message in chat {self.chat_id}: {e}")
+
+    async def finish(self, text=None):
+        # Final state goes out right away; without text the message is removed
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self.pending = None
+        self.finished = True
+        if self.message is None:
+            return
+        if self.pin:
+            try:
+                await self.bot.unpin_chat_message(self.chat_id, self.message.message_id)
+            except TelegramError as e:
+                logger.warning(f"Couldn't unpin status message in chat {self.chat_id}: {e}")
+        if text:
+            await self._edit(text, final=True)
+        else:
+            try:
+                await self.message.delete()
+            except TelegramError as e:
+                logger.warning(f"Couldn't delete status message in chat {self.chat_id}: {e}")
+
+    def progress_hook(self):
+        # yt-dlp calls this from the download thread, many times a second;
+        # hand the loop at most one update per HOOK_INTERVAL
+        loop = asyncio.get_running_loop()
+        last_posted = 0.0
+
+        def hook(status):
+            nonlocal last_posted
+            if status.get("status") != "downloading":
+                return
+            now = time.monotonic()
+            if now - last_posted < HOOK_INTERVAL:
+                return
+            last_posted = now
+            loop.call_soon_threadsafe(self.update, describe_progress(status))
+        return hook
@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Telegram's documented limits: ~30 messages/s overall, ~1/s per chat and
+# 20/min per group. Bursts refill at the same rate.
+GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL", 30))
+CHAT_RATE = float(os.getenv("RATE_LIMIT_CHAT", 1))
+CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", 3))
+GROUP_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", 20))
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 3))
+
+# Lower goes first. Uploads carry finished downloads, so they never wait
+# behind progress edits or pins.
+PRIORITY_UPLOAD = 0
+PRIORITY_NORMAL = 1
+PRIORITY_COSMETIC = 2
+PRIORITY_NAMES = {PRIORITY_UPLOAD: "upload", PRIORITY_NORMAL: "normal", PRIORITY_COSMETIC: "cosmetic"}
+
+UPLOAD_ENDPOINTS = {"sendVideo", "sendDocument", "sendAudio", "sendMediaGroup", "copyMessage", "forwardMessage"}
+COSMETIC_ENDPOINTS = {
+    "editMessageText", "editMessageCaption", "editMessageReplyMarkup", "pinChatMessage",
+    "unpinChatMessage", "deleteMessage", "sendChatAction",
+}
+# The button's spinner is gone long before any retry_after runs out
+CALLBACK_ENDPOINT = "answerCallbackQuery"
+
+
+def priority_for(endpoint):
+    if endpoint in UPLOAD_ENDPOINTS:
+        return PRIORITY_UPLOAD
+    if endpoint in COSMETIC_ENDPOINTS:
+        return PRIORITY_COSMETIC
+    return PRIORITY_NORMAL
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # set from retry_after
+
+    def wait_time(self, now):
+        # Seconds until a token is available (0 if one is available now)
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Ticket:
+    def __init__(self, priority, seq, endpoint, chat_id):
+        self.priority = priority
+        self.seq = seq
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.queued_at = time.monotonic()
+        self.granted = asyncio.get_running_loop().create_future()
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    # Every Bot API call (except getUpdates) asks for a ticket; one dispatcher
+    # hands tickets out in priority order as soon as the global, chat and group
+    # buckets allow it, so a chat that is flooded doesn't hold up the others
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 group_rate_per_minute=GROUP_RATE_PER_MINUTE, max_retries=MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.group_burst = max(1, int(group_rate_per_minute // 4))
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.group_buckets = {}
+        self.pending = []
+        self.granted = 0
+        self.retry_afters = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def initialize(self):
+        self._start()
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _start(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _buckets(self, ticket):
+        buckets = [self.global_bucket]
+        if ticket.chat_id is None:  # answerCallbackQuery, getMe, ...: global only
+            return buckets
+        if ticket.chat_id not in self.chat_buckets:
+            self.chat_buckets[ticket.chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        buckets.append(self.chat_buckets[ticket.chat_id])
+        if is_group(ticket.chat_id):
+            if ticket.chat_id not in self.group_buckets:
+                self.group_buckets[ticket.chat_id] = TokenBucket(self.group_rate, self.group_burst)
+            buckets.append(self.group_buckets[ticket.chat_id])
+        return buckets
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_wait = None
+            for ticket in sorted(self.pending, key=lambda t: (t.priority, t.seq)):
+                if ticket.granted.done():  # caller gave up (cancelled)
+                    self.pending.remove(ticket)
+                    continue
+                buckets = self._buckets(ticket)
+                wait = max(bucket.wait_time(now) for bucket in buckets)
+                if wait == 0:
+                    for bucket in buckets:
+                        bucket.take()
+                    self.pending.remove(ticket)
+                    self.granted += 1
+                    ticket.granted.set_result(None)
+                elif next_wait is None or wait < next_wait:
+                    next_wait = wait
+            self._forget_idle_buckets(now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _forget_idle_buckets(self, now):
+        # Full, unblocked buckets hold no state worth keeping
+        if len(self.chat_buckets) > 1024:
+            waiting = {ticket.chat_id for ticket in self.pending}
+            for buckets in (self.chat_buckets, self.group_buckets):
+                for chat_id in [c for c, b in buckets.items() if c not in waiting and b.idle(now)]:
+                    del buckets[chat_id]
+
+    async def acquire(self, endpoint, chat_id=None):
+        # Wait for permission to make one call; also used by streaming.py,
+        # which posts uploads without going through PTB
+        self._start()
+        ticket = Ticket(priority_for(endpoint), next(self._seq), endpoint, chat_id)
+        self.pending.append(ticket)
+        self._wakeup.set()
+        await ticket.granted
+
+    def back_off(self, chat_id, retry_after, endpoint=None):
+        # Telegram said "retry after N seconds": nothing more for this chat
+        # (or user) until then. Only a call with no chat or user to pin it on
+        # blocks everyone, and never a callback answer.
+        self.retry_afters += 1
+        until = time.monotonic() + retry_after
+        if chat_id is not None:
+            bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        elif endpoint == CALLBACK_ENDPOINT:
+            return
+        else:
+            bucket = self.global_bucket
+        bucket.blocked_until = max(bucket.blocked_until, until)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Calls without a chat (getUserProfilePhotos, ...) are scoped to the
+        # user; a private chat's id is its user's id, so they share a bucket
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            chat_id = data.get("user_id")
+        attempt = 0
+        while True:
+            await self.acquire(endpoint, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.back_off(chat_id, e.retry_after, endpoint)
+                if endpoint == CALLBACK_ENDPOINT:
+                    # Dropped: Telegram's reply to an answered callback is just True
+                    logger.warning(f"Dropping {endpoint} after flood control ({e.retry_after}s)")
+                    return True
+                if endpoint in COSMETIC_ENDPOINTS:
+                    # Stale by the time it could go out; callers skip it on RetryAfter
+                    logger.warning(f"Dropping {endpoint} to chat {chat_id} after flood control ({e.retry_after}s)")
+                    raise
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"{endpoint} to chat {chat_id} hit flood control, retrying in {e.retry_after}s")
+
+    def stats(self):
+        now = time.monotonic()
+        by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+        for ticket in self.pending:
+            by_priority[PRIORITY_NAMES[ticket.priority]] += 1
+        oldest = max((now - ticket.queued_at for ticket in self.pending), default=0.0)
+        blocked = sum(1 for bucket in self.chat_buckets.values() if bucket.blocked_until > now)
+        return {
+            "pending": by_priority,
+            "oldest_wait": oldest,
+            "blocked_chats": blocked,
+            "globally_blocked": self.global_bucket.blocked_until > now,
+            "granted": self.granted,
+            "retry_afters": self.retry_afters,
+        }
+
+
+def is_group(chat_id):
+    # Groups and channels have negative ids; @usernames are public channels/groups
+    if isinstance(chat_id, str):
+        return chat_id.startswith("@") or chat_id.startswith("-")
+    return chat_id < 0
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import uuid
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Every download lives in its own directory under SCRATCH_DIR, named
+# "<job>-<pid>-<random>", and the whole directory goes when the job ends
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "downloads")
+DISK_QUOTA = int(os.getenv("DISK_QUOTA_MB", 4096)) * 1024 * 1024  # 0 = no quota
+MIN_FREE_SPACE = int(os.getenv("MIN_FREE_SPACE_MB", 1024)) * 1024 * 1024
+ROOM_RECHECK_INTERVAL = 5
+JOB_DIR_RE = re.compile(r"^.+-(\d+)-[0-9a-f]+$")
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass  # removed while we were walking
+    return total
+
+
+def usage():
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    return {
+        "used": directory_size(SCRATCH_DIR),
+        "free": shutil.disk_usage(SCRATCH_DIR).free,
+        "quota": DISK_QUOTA,
+        "min_free": MIN_FREE_SPACE,
+    }
+
+
+def has_room():
+    current = usage()
+    if DISK_QUOTA and current["used"] >= DISK_QUOTA:
+        return False
+    return current["free"] >= MIN_FREE_SPACE
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by someone else
+    return True
+
+
+def sweep_orphans():
+    # Run at startup: removes directories of processes that are gone (and any
+    # stray files), left behind by crashes or kills. Directories of other live
+    # workers sharing SCRATCH_DIR are left alone.
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    removed = 0
+    freed = 0
+    for entry in os.scandir(SCRATCH_DIR):
+        match = JOB_DIR_RE.match(entry.name) if entry.is_dir(follow_symlinks=False) else None
+        if match and int(match.group(1)) != os.getpid() and _pid_alive(int(match.group(1))):
+            continue
+        size = directory_size(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat().st_size
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+        removed += 1
+        freed += size
+    if removed:
+        logger.info(f"Swept {removed} orphaned scratch entries ({freed / (1024 * 1024):.1f} MB)")
+    return removed, freed
+
+
+@asynccontextmanager
+async def job_dir(name):
+    path = os.path.join(SCRATCH_DIR, f"{name}-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+    await asyncio.to_thread(os.makedirs, path)
+    try:
+        yield path
+    finally:
+        # Whatever happened (failed send, cancelled job, split parts, playlist
+        # renames), nothing outlives the job
+        await asyncio.to_thread(shutil.rmtree, path, True)
+
+
+async def wait_for_room():
+    # Backpressure for queue workers: don't claim a job while the scratch
+    # area is over quota or the disk is nearly full
+    warned = False
+    while not await asyncio.to_thread(has_room):
+        if not warned:
+            logger.warning("Scratch space is full, holding off on new jobs")
+            warned = True
+        await asyncio.sleep(ROOM_RECHECK_INTERVAL)
+    if warned:
+        logger.info("Scratch space available again, resuming jobs")
@@ -0,0 +1,34 @@
+import asyncio
+
+
+class SingleFlight:
+    # Collapse concurrent calls with the same key into one: the first caller
+    # runs the work, everyone arriving while it is running awaits its result
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        # Returns (result, shared); shared is True for callers that piggybacked
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
@@ -0,0 +1,67 @@
+import re
+
+import httpx
+
+# How much to trust an estimate, best first
+CONFIDENCE_EXACT = "exact"  # container size reported by the site
+CONFIDENCE_APPROX = "approx"  # yt-dlp's filesize_approx
+CONFIDENCE_BITRATE = "bitrate"  # bitrate x duration
+CONFIDENCE_PROBE = "probe"  # Content-Length / Content-Range of the format URL
+CONFIDENCE_UNKNOWN = "unknown"
+
+PROBE_TIMEOUT = 10
+CONTENT_RANGE_RE = re.compile(r"/(\d+)\s*$")
+
+
+class FileTooLargeError(Exception):
+    pass
+
+
+def estimate_format_size(fmt, duration):
+    # Returns (bytes or None, confidence)
+    if fmt.get("filesize"):
+        return int(fmt["filesize"]), CONFIDENCE_EXACT
+    if fmt.get("filesize_approx"):
+        return int(fmt["filesize_approx"]), CONFIDENCE_APPROX
+    if duration:
+        bitrate = fmt.get("tbr")  # kbit/s
+        if not bitrate and (fmt.get("vbr") or fmt.get("abr")):
+            bitrate = (fmt.get("vbr") or 0) + (fmt.get("abr") or 0)
+        if bitrate:
+            return int(bitrate * 1000 / 8 * duration), CONFIDENCE_BITRATE
+    return None, CONFIDENCE_UNKNOWN
+
+
+def probe_format_size(fmt):
+    # Last resort for formats the site gave no size or bitrate for. Blocking,
+    # so callers run it on the extraction pool.
+    url = fmt.get("url")
+    if not url or fmt.get("protocol") not in ("http", "https"):
+        return None
+    headers = dict(fmt.get("http_headers") or {})
+    headers["Accept-Encoding"] = "identity"
+    with httpx.Client(timeout=PROBE_TIMEOUT, follow_redirects=True) as client:
+        try:
+            response = client.head(url, headers=headers)
+            length = response.headers.get("Content-Length")
+            if response.is_success and length and length.isdigit() and int(length) > 0:
+                return int(length)
+            # Some CDNs refuse HEAD; a one-byte range request reveals the total
+            with client.stream("GET", url, headers={**headers, "Range": "bytes=0-0"}) as response:
+                match = CONTENT_RANGE_RE.search(response.headers.get("Content-Range", ""))
+                if match:
+                    return int(match.group(1))
+        except httpx.HTTPError:
+            return None
+    return None
+
+
+def size_limit_hook(max_bytes):
+    # yt-dlp progress hook that aborts a download as soon as it passes
+    # max_bytes, even when the size wasn't known up front
+    def hook(status):
+        downloaded = status.get("downloaded_bytes") or 0
+        expected = status.get("total_bytes") or 0  # exact only; fragment estimates wobble
+        if status.get("status") == "downloading" and (downloaded > max_bytes or expected > max_bytes):
+            raise FileTooLargeError(f"download exceeds {max_bytes} bytes")
+    return hook
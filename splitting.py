@@ -0,0 +1,122 @@
+import asyncio
+import csv
+import logging
+import os
+import uuid
+from contextlib import aclosing
+
+logger = logging.getLogger(__name__)
+
+# Aim below the limit: segments are cut on keyframes, so real sizes wobble
+SPLIT_SAFETY_FACTOR = 0.9
+LIST_POLL_INTERVAL = 0.5
+SPLIT_MAX_DEPTH = 2  # times an oversize part is split again before giving up
+
+
+class PartTooLarge(Exception):
+    pass
+
+
+async def probe_duration(path):
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {stderr.decode(errors='ignore').strip()}")
+    return float(stdout.decode().strip())
+
+
+def _read_segment_list(list_path):
+    if not os.path.exists(list_path):
+        return []
+    with open(list_path, newline="") as list_file:
+        text = list_file.read()
+    # Only whole lines: ffmpeg may be halfway through writing the last one
+    lines = text.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+    return [row[0] for row in csv.reader(lines) if row]
+
+
+async def _checked_parts(part_path, max_size, depth):
+    # Bitrate isn't even, so a part can still come out over the limit: split
+    # that one again (its own size and duration give a shorter segment time)
+    part_size = await asyncio.to_thread(os.path.getsize, part_path)
+    if part_size <= max_size:
+        yield part_path
+        return
+    try:
+        if depth >= SPLIT_MAX_DEPTH:
+            raise PartTooLarge(
+                f"📦 A part of this video is still {part_size / (1024 * 1024):.0f} MB after splitting, "
+                f"over Telegram's {max_size / (1024 * 1024):.0f} MB limit."
+            )
+        logger.warning(f"{part_path} is {part_size} bytes, over {max_size}; splitting it again")
+        async with aclosing(split_media(part_path, max_size, depth + 1)) as parts:
+            async for sub_part in parts:
+                yield sub_part
+    finally:
+        await asyncio.to_thread(os.remove, part_path)
+
+
+async def split_media(path, max_size, depth=0):
+    # Cut `path` into stand-alone parts of at most max_size bytes using
+    # ffmpeg's segment muxer with stream copy (no re-encode, so it splits on
+    # keyframes). Yields each part as soon as ffmpeg has closed it, so the
+    # caller can upload part 1 while later parts are still being written.
+    file_size = os.path.getsize(path)
+    duration = await probe_duration(path)
+    safety = SPLIT_SAFETY_FACTOR ** (depth + 1)
+    segment_time = max(1.0, duration * (max_size * safety) / file_size)
+
+    # Parts get a name of our own: the downloaded one comes from the title,
+    # and a "%" in it breaks ffmpeg's segment pattern. Unique per call, since
+    # an oversize part is re-split in the same directory.
+    ext = os.path.splitext(path)[1]
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.join(directory, f"part_{uuid.uuid4().hex[:8]}")
+    pattern = f"{prefix}_%03d{ext}"
+    list_path = f"{prefix}.csv"
+
+    logger.info(f"Splitting {path} ({file_size} bytes, {duration:.0f}s) into ~{segment_time:.0f}s parts")
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", path,
+        "-map", "0", "-c", "copy",
+        "-f", "segment",
+        "-segment_time", f"{segment_time:.3f}",
+        "-reset_timestamps", "1",
+        "-segment_list", list_path,
+        "-segment_list_type", "csv",
+        pattern,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    wait_task = asyncio.create_task(process.wait())
+    yielded = 0
+    try:
+        while True:
+            # ffmpeg appends a line to the list each time it closes a segment
+            done, _ = await asyncio.wait({wait_task}, timeout=LIST_POLL_INTERVAL)
+            finished = _read_segment_list(list_path)
+            for name in finished[yielded:]:
+                yielded += 1
+                async with aclosing(_checked_parts(os.path.join(directory, name), max_size, depth)) as parts:
+                    async for part_path in parts:
+                        yield part_path
+            if done:
+                break
+
+        if process.returncode != 0:
+            stderr = await process.stderr.read()
+            raise RuntimeError(f"ffmpeg split failed: {stderr.decode(errors='ignore').strip()}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await wait_task
+        if os.path.exists(list_path):
+            os.remove(list_path)
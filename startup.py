@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import time
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+STARTUP_LOG_PATH = os.getenv("STARTUP_LOG_PATH", "logs/startup_times.jsonl")
+
+
+def process_started_at():
+    # Wall-clock time the process was created, so interpreter start-up and
+    # imports before this module count too. Linux only; None elsewhere.
+    try:
+        with open("/proc/self/stat") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        started_after_boot = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - (uptime - started_after_boot)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    # Seconds from process start to each phase. One line per start goes to
+    # logs/startup_times.jsonl once the bot is ready and yt-dlp is warm.
+    def __init__(self, path, required=("ready", "warm_up")):
+        self.path = path
+        self.required = required
+        self.started = process_started_at() or time.time()
+        self.phases = {}
+        self.written = False
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        self.phases[phase] = round(time.time() - self.started, 3)
+        logger.info(f"Startup: {phase} after {self.phases[phase]:.2f}s")
+        if not self.written and all(name in self.phases for name in self.required):
+            self.write()
+
+    def write(self):
+        self.written = True
+        record = {
+            "ts": time.time(),
+            "release": os.getenv("RELEASE"),
+            "pid": os.getpid(),
+            **self.phases,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning(f"Couldn't write startup times: {e}")
+
+
+startup_timer = StartupTimer(STARTUP_LOG_PATH)
+
+
+class TimedUpdatesRequest(HTTPXRequest):
+    # Used as the getUpdates request: sending the first long poll is the
+    # moment the bot starts answering users
+    async def do_request(self, url, method, *args, **kwargs):
+        if url.endswith("/getUpdates"):
+            startup_timer.mark("first_get_updates")
+            startup_timer.mark("ready")
+        return await super().do_request(url, method, *args, **kwargs)
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from callbacks import short_hash
+from utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DB_PATH", "videos.db")
+VIDEO_RETENTION_DAYS = float(os.getenv("VIDEO_RETENTION_DAYS", 7))
+FILE_ID_RETENTION_DAYS = float(os.getenv("FILE_ID_RETENTION_DAYS", 90))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 3))
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", 3))
+VIDEO_TOUCH_INTERVAL = 86400  # refresh created_at at most daily on repeat pastes
+KNOWN_IDS_CACHE_SIZE = 4096
+MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", 6 * 3600))
+VACUUM_MIN_DELETED = int(os.getenv("DB_VACUUM_MIN_DELETED", 5000))
+
+# Every statement lives here so sqlite3's per-connection statement cache
+# keeps them compiled for the life of the process
+SQL_INSERT_VIDEO = "INSERT INTO videos (id, url, created_at) VALUES (?, ?, ?) ON CONFLICT (id) DO NOTHING"
+SQL_SELECT_VIDEO = "SELECT url FROM videos WHERE id = ?"
+SQL_SELECT_VIDEO_ROW = "SELECT url, created_at FROM videos WHERE id = ?"
+SQL_TOUCH_VIDEO = "UPDATE videos SET created_at = ? WHERE id = ?"
+SQL_UPSERT_FILE_ID = (
+    "INSERT OR REPLACE INTO file_ids (url, format_id, part, file_id, caption, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_SELECT_FILE_IDS = "SELECT file_id, caption FROM file_ids WHERE url = ? AND format_id = ? ORDER BY part"
+SQL_DELETE_FILE_IDS = "DELETE FROM file_ids WHERE url = ? AND format_id = ?"
+SQL_PURGE_VIDEOS = "DELETE FROM videos WHERE created_at < ?"
+SQL_PURGE_FILE_IDS = "DELETE FROM file_ids WHERE created_at < ?"
+SQL_PURGE_JOBS = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?"
+
+SQL_INSERT_JOB = (
+    "INSERT INTO jobs (chat_id, user_id, url, format_id, reply_to_msg_id, metadata, status, attempts, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, ?)"
+)
+SQL_USER_BACKLOG = "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')"
+# Leases of crashed workers run out: retry the job, or give up after max attempts
+SQL_REQUEUE_EXPIRED = (
+    "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL "
+    "WHERE status = 'running' AND lease_expires < ? AND attempts < ?"
+)
+SQL_FAIL_EXPIRED = (
+    "UPDATE jobs SET status = 'failed', error = 'lease expired too many times', finished_at = ? "
+    "WHERE status = 'running' AND lease_expires < ?"
+)
+# Round-robin across users: the user served least recently goes first, and
+# users already at their in-flight limit are skipped. One statement, so two
+# workers can never claim the same row.
+SQL_CLAIM_JOB = """
+    UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, started_at = ?, attempts = attempts + 1
+    WHERE status = 'queued' AND id = (
+        SELECT j.id FROM jobs j
+        WHERE j.status = 'queued'
+          AND (SELECT COUNT(*) FROM jobs r WHERE r.user_id = j.user_id AND r.status = 'running') < ?
+        ORDER BY (SELECT COALESCE(MAX(s.started_at), 0) FROM jobs s WHERE s.user_id = j.user_id), j.id
+        LIMIT 1
+    )
+    RETURNING id, chat_id, user_id, url, format_id, reply_to_msg_id, metadata, created_at
+"""
+SQL_RENEW_LEASE = "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'running'"
+SQL_FINISH_JOB = (
+    "UPDATE jobs SET status = ?, error = ?, outcome = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL "
+    "WHERE id = ? AND lease_owner = ?"
+)
+SQL_QUEUED_JOBS = "SELECT id, user_id FROM jobs WHERE status = 'queued' ORDER BY id"
+SQL_LAST_SERVED = "SELECT user_id, MAX(started_at) FROM jobs WHERE started_at IS NOT NULL GROUP BY user_id"
+SQL_JOB_COUNTS = "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+
+_conn = None
+_lock = threading.Lock()
+_known_ids = OrderedDict()  # video_id -> (normalized url, last touch), so repeats skip the disk
+# One thread owns all database work, so the event loop never waits on an fsync
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+
+def get_connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=64)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA busy_timeout=5000")
+    return _conn
+
+
+async def run_db(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
+
+
+# Function to initialize the database
+def init_db():
+    with _lock:
+        conn = get_connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS videos (
+                id TEXT PRIMARY KEY,
+                url TEXT
+            )
+        """
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(videos)")]
+        if "created_at" not in columns:
+            # Rows from before retention existed start their clock now
+            conn.execute("ALTER TABLE videos ADD COLUMN created_at REAL")
+            conn.execute("UPDATE videos SET created_at = ? WHERE created_at IS NULL", (time.time(),))
+        conn.execute("CREATE INDEX IF NOT EXISTS videos_created_at ON videos (created_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_ids (
+                url TEXT,
+                format_id TEXT,
+                part INTEGER,
+                file_id TEXT,
+                caption TEXT,
+                created_at REAL,
+                PRIMARY KEY (url, format_id, part)
+            )
+        """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                user_id INTEGER,
+                url TEXT,
+                format_id TEXT,
+                reply_to_msg_id INTEGER,
+                metadata BLOB,
+                status TEXT,
+                attempts INTEGER,
+                lease_owner TEXT,
+                lease_expires REAL,
+                outcome TEXT,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, status)")
+        conn.commit()
+
+
+def _remember_id(video_id, key, touched_at):
+    _known_ids[video_id] = (key, touched_at)
+    _known_ids.move_to_end(video_id)
+    while len(_known_ids) > KNOWN_IDS_CACHE_SIZE:
+        _known_ids.popitem(last=False)
+
+
+# Function to store URL and get its ID. The ID is derived from the
+# normalized URL, so pasting the same link again reuses the same row.
+def store_video_url(url):
+    key = normalize_url(url)
+    now = time.time()
+    with _lock:
+        for length in (8, 11, 16, 22):
+            video_id = short_hash(key, length)
+            known = _known_ids.get(video_id)
+            if known and known[0] == key and now - known[1] < VIDEO_TOUCH_INTERVAL:
+                _known_ids.move_to_end(video_id)
+                return video_id
+
+            conn = get_connection()
+            row = conn.execute(SQL_SELECT_VIDEO_ROW, (video_id,)).fetchone()
+            if row is None:
+                conn.execute(SQL_INSERT_VIDEO, (video_id, url, now))
+                conn.commit()
+                _remember_id(video_id, key, now)
+                return video_id
+            if normalize_url(row[0]) == key:
+                touched_at = row[1] or 0
+                if now - touched_at >= VIDEO_TOUCH_INTERVAL:
+                    # Keep the row clear of the retention purge while it is in use
+                    conn.execute(SQL_TOUCH_VIDEO, (now, video_id))
+                    conn.commit()
+                    touched_at = now
+                _remember_id(video_id, key, touched_at)
+                return video_id
+            # Hash prefix collision with a different URL: try a longer ID
+    raise RuntimeError(f"Could not allocate a video id for {url}")
+
+
+# Function to get the URL from the ID
+def get_video_url(video_id):
+    with _lock:
+        result = get_connection().execute(SQL_SELECT_VIDEO, (video_id,)).fetchone()
+    return result[0] if result else None
+
+
+# Function to remember the Telegram file_ids (one per part) of an upload
+def store_file_ids(url, format_id, file_ids, caption=None):
+    now = time.time()
+    key = normalize_url(url)
+    with _lock:
+        conn = get_connection()
+        conn.executemany(
+            SQL_UPSERT_FILE_ID,
+            [(key, format_id or "", part, file_id, caption, now) for part, file_id in enumerate(file_ids)],
+        )
+        conn.commit()
+
+
+# Function to get the cached file_ids for a URL + format
+def get_file_ids(url, format_id):
+    with _lock:
+        return get_connection().execute(SQL_SELECT_FILE_IDS, (normalize_url(url), format_id or "")).fetchall()
+
+
+# Function to forget file_ids Telegram no longer accepts
+def delete_file_ids(url, format_id):
+    with _lock:
+        conn = get_connection()
+        conn.execute(SQL_DELETE_FILE_IDS, (normalize_url(url), format_id or ""))
+        conn.commit()
+
+
+# Function to add a download job to the durable queue
+def enqueue_job(chat_id, user_id, url, format_id, reply_to_msg_id, metadata_blob, max_backlog):
+    with _lock:
+        conn = get_connection()
+        backlog = conn.execute(SQL_USER_BACKLOG, (user_id,)).fetchone()[0]
+        if backlog >= max_backlog:
+            return None
+        job_id = conn.execute(
+            SQL_INSERT_JOB, (chat_id, user_id, url, format_id, reply_to_msg_id, metadata_blob, time.time())
+        ).lastrowid
+        conn.commit()
+    return job_id
+
+
+# Function to lease the next job for a worker, fairly across users
+def claim_job(worker_id, lease_seconds, per_user_limit):
+    now = time.time()
+    with _lock:
+        conn = get_connection()
+        conn.execute(SQL_REQUEUE_EXPIRED, (now, MAX_JOB_ATTEMPTS))
+        conn.execute(SQL_FAIL_EXPIRED, (now, now))
+        row = conn.execute(SQL_CLAIM_JOB, (worker_id, now + lease_seconds, now, per_user_limit)).fetchone()
+        conn.commit()
+    return row
+
+
+def renew_lease(job_id, worker_id, lease_seconds):
+    with _lock:
+        conn = get_connection()
+        renewed = conn.execute(SQL_RENEW_LEASE, (time.time() + lease_seconds, job_id, worker_id)).rowcount
+        conn.commit()
+    return renewed == 1
+
+
+def finish_job(job_id, worker_id, status, outcome=None, error=None):
+    with _lock:
+        conn = get_connection()
+        conn.execute(SQL_FINISH_JOB, (status, error, outcome, time.time(), job_id, worker_id))
+        conn.commit()
+
+
+# Function to get the queue snapshot used for position estimates
+def queue_snapshot():
+    with _lock:
+        conn = get_connection()
+        queued = conn.execute(SQL_QUEUED_JOBS).fetchall()
+        last_served = dict(conn.execute(SQL_LAST_SERVED).fetchall())
+    return queued, last_served
+
+
+def job_counts():
+    with _lock:
+        return dict(get_connection().execute(SQL_JOB_COUNTS).fetchall())
+
+
+# Fold the WAL back into videos.db, e.g. before sending the file somewhere
+def checkpoint():
+    with _lock:
+        get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def purge_expired():
+    now = time.time()
+    with _lock:
+        conn = get_connection()
+        videos = conn.execute(SQL_PURGE_VIDEOS, (now - VIDEO_RETENTION_DAYS * 86400,)).rowcount
+        file_ids = conn.execute(SQL_PURGE_FILE_IDS, (now - FILE_ID_RETENTION_DAYS * 86400,)).rowcount
+        jobs = conn.execute(SQL_PURGE_JOBS, (now - JOB_RETENTION_DAYS * 86400,)).rowcount
+        conn.commit()
+        if videos + file_ids + jobs >= VACUUM_MIN_DELETED:
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return videos, file_ids, jobs
+
+
+async def maintenance_loop():
+    while True:
+        try:
+            videos, file_ids, jobs = await run_db(purge_expired)
+            logger.info(f"DB maintenance: purged {videos} video rows, {file_ids} file_id rows and {jobs} jobs")
+        except Exception as e:
+            logger.exception(f"DB maintenance failed: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
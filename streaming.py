@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import uuid
+
+import httpx
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from sizing import FileTooLargeError
+from telemetry import count_api_call
+
+logger = logging.getLogger(__name__)
+
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "1") == "1"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))
+STREAM_BUFFER_CHUNKS = int(os.getenv("STREAM_BUFFER_CHUNKS", 16))  # ~4 MB in flight at most
+
+# Single-file progressive formats are already complete, playable files, so
+# their bytes can go straight into the upload. Anything yt-dlp has to merge
+# or remux needs a seekable file on disk and takes the temp-file path.
+STREAMABLE_PROTOCOLS = ("http", "https")
+STREAMABLE_EXTS = ("mp4", "webm", "mov", "m4v")
+
+_client = None
+
+
+class StreamUnavailable(Exception):
+    pass
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(connect=30, read=300, write=300, pool=30),
+            follow_redirects=True,
+        )
+    return _client
+
+
+def find_streamable_format(metadata, format_id):
+    if not format_id or "+" in format_id or "/" in format_id:
+        return None
+    if metadata.info.get("_type") == "playlist":
+        return None
+    for fmt in metadata.info.get("formats") or []:
+        if str(fmt.get("format_id")) != format_id:
+            continue
+        if fmt.get("protocol") not in STREAMABLE_PROTOCOLS or fmt.get("ext") not in STREAMABLE_EXTS:
+            return None
+        if fmt.get("cookies") or not fmt.get("url"):
+            # Cookie-bound URLs need yt-dlp's own cookie handling
+            return None
+        return fmt
+    return None
+
+
+def _form_field(boundary, name, value):
+    return (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n"
+    ).encode("utf-8")
+
+
+async def _pump(source, buffer):
+    # Producer: source response -> bounded queue. Blocks when the upload
+    # side falls behind, so memory stays at STREAM_BUFFER_CHUNKS * chunk size.
+    try:
+        async for chunk in source.aiter_raw(STREAM_CHUNK_SIZE):
+            await buffer.put(chunk)
+        await buffer.put(None)
+    except Exception as e:
+        await buffer.put(e)
+
+
+def _read_reply(response):
+    # A proxy or load balancer in front of the Bot API can answer with HTML.
+    # That's our side, not the video site's: chained to a TelegramError so
+    # classify() keeps it away from the site's circuit breaker.
+    content_type = response.headers.get("Content-Type", "")
+    if "json" not in content_type:
+        raise StreamUnavailable(
+            f"Bot API answered {response.status_code} with {content_type or 'no content type'}"
+        ) from TelegramError(f"non-JSON reply ({response.status_code})")
+    try:
+        payload = json.loads(response.content)
+    except ValueError as e:
+        raise StreamUnavailable(f"Bot API answered {response.status_code} with malformed JSON") from TelegramError(str(e))
+    if not isinstance(payload, dict) or (payload.get("ok") and "result" not in payload):
+        raise StreamUnavailable(f"Bot API answered {response.status_code} without a result") from TelegramError(
+            "unexpected reply"
+        )
+    return payload
+
+
+async def stream_video(bot, chat_id, metadata, format_id, caption=None, reply_to_msg_id=None, max_size=None):
+    fmt = find_streamable_format(metadata, format_id)
+    if fmt is None:
+        raise StreamUnavailable(f"format {format_id} needs a seekable file")
+
+    # This upload skips PTB, so it waits its turn at the rate limiter itself
+    limiter = getattr(bot, "rate_limiter", None)
+    if not hasattr(limiter, "acquire"):
+        limiter = None
+    if limiter is not None:
+        await limiter.acquire("sendVideo", chat_id)
+
+    client = get_client()
+    headers = dict(fmt.get("http_headers") or {})
+    # Raw bytes must match Content-Length, so no transfer compression
+    headers["Accept-Encoding"] = "identity"
+    async with client.stream("GET", fmt["url"], headers=headers) as source:
+        source.raise_for_status()
+        size = source.headers.get("Content-Length")
+        if not size or not size.isdigit():
+            # Without a length we cannot frame the multipart body up front
+            raise StreamUnavailable("source did not report Content-Length")
+        size = int(size)
+        if max_size and size > max_size:
+            raise FileTooLargeError(f"{size} bytes exceeds {max_size}")
+
+        boundary = uuid.uuid4().hex
+        filename = f"{metadata.info.get('id') or 'video'}.{fmt['ext']}"
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        fields = {"chat_id": chat_id, "supports_streaming": "true"}
+        if caption:
+            fields["caption"] = caption
+        if reply_to_msg_id:
+            fields["reply_to_message_id"] = reply_to_msg_id
+        if metadata.info.get("duration"):
+            fields["duration"] = int(metadata.info["duration"])
+        head = b"".join(_form_field(boundary, name, value) for name, value in fields.items())
+        head += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="video"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        buffer = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+        pump = asyncio.create_task(_pump(source, buffer))
+
+        async def body():
+            yield head
+            while True:
+                chunk = await buffer.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            yield tail
+
+        try:
+            logger.info(f"Streaming {size} bytes of {metadata.url} [{format_id}] to chat {chat_id}")
+            count_api_call("sendVideo")  # goes around PTB, so count it here
+            response = await client.post(
+                f"{bot.base_url}/sendVideo",
+                content=body(),
+                headers={
+                    "Content-Type": f"multipart/form-data; boundary={boundary}",
+                    "Content-Length": str(len(head) + size + len(tail)),
+                },
+            )
+        finally:
+            pump.cancel()
+
+    payload = _read_reply(response)
+    if not payload.get("ok"):
+        description = payload.get("description", "upload failed")
+        retry_after = (payload.get("parameters") or {}).get("retry_after")
+        if retry_after:
+            if limiter is not None:
+                limiter.back_off(chat_id, retry_after)
+            raise RetryAfter(retry_after)
+        if response.status_code == 400:
+            raise BadRequest(description)
+        raise TelegramError(description)
+    return Message.de_json(payload["result"], bot)
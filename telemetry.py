@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+
+from telegram.request import HTTPXRequest
+
+from utils import AUDIO_FORMAT
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))  # 0 disables the endpoint
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, kind="counter"):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {kind}"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self.values[key] = value
+
+    def render(self, kind="gauge"):
+        return super().render(kind)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def merged(self, **match):
+        # Bucket counts and sum over every series whose labels match
+        merged = [0] * (len(self.buckets) + 1) + [0.0]
+        with self._lock:
+            for key, series in self.series.items():
+                labels = dict(zip(self.labels, key))
+                if all(labels.get(name) == value for name, value in match.items()):
+                    merged = [a + b for a, b in zip(merged, series)]
+        return merged
+
+    def label_values(self, name):
+        index = self.labels.index(name)
+        with self._lock:
+            return sorted({key[index] for key in self.series})
+
+    def quantile(self, q, **match):
+        # Linear interpolation inside the bucket, like histogram_quantile()
+        series = self.merged(**match)
+        counts = series[:-1]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower  # in the +Inf bucket: the best we can say
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self.series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# format: "default", "audio" or "selected"; raw format ids are per-site and unbounded
+stage_seconds = Histogram(
+    "bot_stage_seconds", "Time spent per job stage", ("stage", "extractor", "format", "outcome")
+)
+job_seconds = Histogram("bot_job_seconds", "Wall time per job", ("extractor", "outcome"))
+job_api_calls = Histogram(
+    "bot_job_api_calls", "Telegram Bot API calls made per job", ("outcome",), buckets=COUNT_BUCKETS
+)
+jobs_total = Counter("bot_jobs_total", "Finished jobs", ("extractor", "outcome"))
+api_calls_total = Counter("bot_api_calls_total", "Telegram Bot API calls", ("method",))
+bytes_sent_total = Counter("bot_bytes_sent_total", "Bytes uploaded to Telegram", ("extractor",))
+worker_busy_seconds_total = Counter("bot_worker_busy_seconds_total", "Seconds queue workers spent on jobs")
+workers_busy = Gauge("bot_workers_busy", "Queue workers currently running a job")
+workers_total = Gauge("bot_workers", "Queue workers in this process")
+queue_jobs = Gauge("bot_queue_jobs", "Jobs in the durable queue by status", ("status",))
+pool_pending = Gauge("bot_pool_pending", "Calls running or waiting in an executor pool", ("pool",))
+pool_limit = Gauge("bot_pool_limit", "Calls an executor pool accepts before refusing", ("pool",))
+cache_entries = Gauge("bot_metadata_cache_entries", "Entries in the metadata cache")
+cache_hit_ratio = Gauge("bot_metadata_cache_hit_ratio", "Metadata cache hit ratio since start")
+limiter_pending = Gauge("bot_send_queue_pending", "Bot API calls waiting at the rate limiter", ("priority",))
+limiter_oldest_wait = Gauge("bot_send_queue_oldest_wait_seconds", "Age of the oldest call waiting at the rate limiter")
+limiter_blocked_chats = Gauge("bot_send_queue_blocked_chats", "Chats currently in a Telegram flood wait")
+limiter_retry_afters = Gauge("bot_send_queue_retry_afters", "429 responses seen since start")
+scratch_used = Gauge("bot_scratch_used_bytes", "Bytes in the download scratch directory")
+scratch_free = Gauge("bot_scratch_free_bytes", "Free bytes on the scratch directory's filesystem")
+scratch_quota = Gauge("bot_scratch_quota_bytes", "DISK_QUOTA_MB in bytes (0 = no quota)")
+# site: extractor key, or Generic:<host> for sites without their own extractor
+breaker_state = Gauge("bot_circuit_state", "Per-site circuit: 0 closed, 1 half open, 2 open", ("site",))
+breaker_failure_rate = Gauge("bot_circuit_failure_rate", "Share of recent jobs the site failed", ("site",))
+breaker_rejected = Gauge("bot_circuit_rejected_jobs", "Jobs fast-failed by the circuit since start", ("site",))
+
+REGISTRY = [
+    stage_seconds, job_seconds, job_api_calls, jobs_total, api_calls_total, bytes_sent_total,
+    worker_busy_seconds_total, workers_busy, workers_total, queue_jobs, pool_pending, pool_limit,
+    cache_entries, cache_hit_ratio, limiter_pending, limiter_oldest_wait, limiter_blocked_chats,
+    limiter_retry_afters, scratch_used, scratch_free, scratch_quota, breaker_state, breaker_failure_rate,
+    breaker_rejected,
+]
+
+# Called before each scrape to refresh gauges that are cheaper to read on demand
+collectors = []
+
+
+def format_kind(format_id):
+    if not format_id:
+        return "default"
+    return "audio" if format_id == AUDIO_FORMAT else "selected"
+
+
+def observe_job(record, stages):
+    extractor = record.get("extractor") or "unknown"
+    outcome = record.get("outcome") or "unknown"
+    kind = format_kind(record.get("format_id"))
+    for stage, seconds in stages.items():
+        stage_seconds.observe(seconds, stage=stage, extractor=extractor, format=kind, outcome=outcome)
+    job_seconds.observe(record["total_s"], extractor=extractor, outcome=outcome)
+    job_api_calls.observe(record.get("api_calls", 0), outcome=outcome)
+    jobs_total.inc(extractor=extractor, outcome=outcome)
+    if record.get("bytes"):
+        bytes_sent_total.inc(record["bytes"], extractor=extractor)
+
+
+def count_api_call(method):
+    # Imported here so the two modules don't import each other at load time
+    from metrics import add_api_call
+
+    api_calls_total.inc(method=method)
+    add_api_call()
+
+
+class CountingRequest(HTTPXRequest):
+    # Bot API request that counts every call, globally and for the current job
+    async def do_request(self, url, method, *args, **kwargs):
+        count_api_call(url.rsplit("/", 1)[-1])
+        return await super().do_request(url, method, *args, **kwargs)
+
+
+class WorkerGauge:
+    # Wraps one job in process_queue: busy workers now, busy seconds overall
+    def __enter__(self):
+        self.started = time.perf_counter()
+        workers_busy.inc(1)
+        return self
+
+    def __exit__(self, *exc_info):
+        workers_busy.inc(-1)
+        worker_busy_seconds_total.inc(time.perf_counter() - self.started)
+
+
+async def render():
+    for collect in collectors:
+        try:
+            await collect()
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {e}")
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass  # headers
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", (await render()).encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    # Prometheus text format on http://host:port/metrics
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
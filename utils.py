@@ -1,27 +1,167 @@
+import copy
 import random
 import re
 from uuid import uuid4
 import os
+import time
 from datetime import datetime
-from yt_dlp import YoutubeDL
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from cache import MetadataCache, stream_expiry
+from profiles import ydl_options_for, profile_name_for
+from sizing import estimate_format_size, size_limit_hook, FileTooLargeError
+from scratch import SCRATCH_DIR
+from ydl_pool import ydl_pool
 
-def get_video_info(url):
-    with YoutubeDL() as ydl:
+# Sites whose query string is pure tracking noise
+CLEAN_URL_SITES = ["faphouse.com"]
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "yclid", "igshid", "igsh", "si", "feature",
+    "ref", "ref_src", "ref_url", "mc_cid", "mc_eid", "_ga", "spm", "share_id",
+}
+
+# Audio mode travels through the keyboard, queue and file_id cache as this
+# format id. Telegram's music player takes m4a and mp3: AAC is remuxed to m4a
+# and mp3 kept as is (both without re-encoding), anything else becomes mp3.
+AUDIO_FORMAT = "bestaudio"
+AUDIO_MP3_QUALITY = os.getenv("AUDIO_MP3_QUALITY", "192")  # kbit/s, only when re-encoding
+
+metadata_cache = MetadataCache(
+    max_entries=int(os.getenv("METADATA_CACHE_SIZE", 256)),
+    ttl=int(os.getenv("METADATA_CACHE_TTL", 900)),
+)
+
+
+def normalize_url(url):
+    # Same idea as suggest_clean_url: drop tracking params so the same video
+    # pasted from different share buttons maps to one cache key
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if any(site in host for site in CLEAN_URL_SITES):
+        query = ""
+    else:
+        params = [
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+        ]
+        query = urlencode(sorted(params))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), host, path, query, ""))
+
+
+class VideoMetadata:
+    # Everything one extraction gives us, built once per URL and passed
+    # through the whole request (keyboard -> queue -> download)
+    def __init__(self, url, info):
+        self.url = url
+        self.info = info
+        started = time.perf_counter()
+        self.quality_options = parse_quality_options(info)
+        self.audio_option = parse_audio_option(info)
+        self.duration = get_duration(info)
+        self.file_size = get_file_size(info)
+        self.parse_seconds = time.perf_counter() - started
+
+    @property
+    def title(self):
+        return self.info.get("title", "Untitled")
+
+    @property
+    def thumbnail(self):
+        return self.info.get("thumbnail")
+
+    @property
+    def is_playlist(self):
+        return self.info.get("_type") == "playlist" or "entries" in self.info
+
+    @property
+    def entries(self):
+        # Flat url stubs (see extract_metadata); playlists.py resolves them
+        return [entry for entry in self.info.get("entries") or [] if entry]
+
+    def find_format(self, format_id):
+        if format_id == AUDIO_FORMAT:
+            return self.audio_option
+        return next((q for q in self.quality_options if q["format_id"] == format_id), None)
+
+    def raw_format(self, format_id):
+        # The yt-dlp format dict behind a quality option
+        if format_id == AUDIO_FORMAT:
+            format_id = self.audio_option["source_format_id"] if self.audio_option else None
+        return next((f for f in self.info.get("formats") or [] if str(f.get("format_id")) == format_id), None)
+
+
+# yt_dlp takes a noticeable part of a second to import, so it is loaded on
+# first use (or by warm_up() in the background) instead of at bot startup
+def warm_up():
+    from yt_dlp.extractor import gen_extractor_classes
+
+    gen_extractor_classes()
+    # First instances (and the cookie jar) are ready before the first request
+    ydl_pool.warm(EXTRACT_PROFILE, EXTRACT_OPTIONS)
+    ydl_pool.warm(download_profile("default"), download_options("default"))
+
+
+# Playlist entries stay unresolved stubs: resolving a 200-video playlist just
+# to show it is refused, or before the first entry can be sent, is waste
+EXTRACT_PROFILE = ("extract",)
+EXTRACT_OPTIONS = {"extract_flat": "in_playlist"}
+
+
+def download_profile(profile_name, audio_codec=None):
+    return ("download", profile_name, audio_codec)
+
+
+def download_options(profile_name, audio_codec=None):
+    # Options fixed per pooled instance; outtmpl, format and hooks are per call
+    options = {
+        "verbose": os.getenv("YTDLP_VERBOSE") == "1",
+        # Fragment concurrency, chunk/buffer sizes, retries and external
+        # downloader depend on the site
+        **ydl_options_for(profile_name=profile_name),
+    }
+    if audio_codec:
+        options["postprocessors"] = [{
+            # Stream copy when the source codec already matches
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": audio_codec,
+            "preferredquality": AUDIO_MP3_QUALITY,
+        }]
+    return options
+
+
+def extract_metadata(url):
+    cache_key = normalize_url(url)
+    cached = metadata_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with ydl_pool.lease(EXTRACT_PROFILE, EXTRACT_OPTIONS) as ydl:
         info = ydl.extract_info(url, download=False)
         sanitized_info = ydl.sanitize_info(info)
-        thumbnail_url = info.get("thumbnail", "No thumbnail found")
-        print(f"This is the sanitized info thumbnail {thumbnail_url}")
-        return sanitized_info
+    thumbnail_url = sanitized_info.get("thumbnail", "No thumbnail found")
+    print(f"This is the sanitized info thumbnail {thumbnail_url}")
+    metadata = VideoMetadata(url, sanitized_info)
+    metadata_cache.set(cache_key, metadata, expires_at=stream_expiry(sanitized_info))
+    return metadata
+
+
+def invalidate_metadata(url):
+    metadata_cache.invalidate(normalize_url(url))
+
+
+def get_video_info(url):
+    return extract_metadata(url).info
 
 def get_file_size(sanitized_info):
-    default_size = 10 * 1024 * 1024  # 10MB in bytes
-    if "filesize_approx" in sanitized_info:
-        file_size = sanitized_info["filesize_approx"]
-        if file_size is None:
-            return default_size
+    # After processing, the top level carries the fields of yt-dlp's default
+    # format choice; fall back to the largest known per-format estimate
+    file_size, _ = estimate_format_size(sanitized_info, sanitized_info.get("duration"))
+    if file_size:
         return file_size
-    else:
-        return default_size
+    duration = sanitized_info.get("duration")
+    estimates = [estimate_format_size(fmt, duration)[0] for fmt in sanitized_info.get("formats") or []]
+    return max((size for size in estimates if size), default=None)
 
 def get_duration(sanitized_info):
     if "duration" in sanitized_info:
@@ -31,9 +171,11 @@ def get_duration(sanitized_info):
     return 600  # Default duration of 10 minutes in seconds
 
 def get_video_formats(url):
-    with YoutubeDL() as ydl:
-        info = ydl.extract_info(url, download=False)
-        formats = info.get("formats", [])
+    return extract_metadata(url).quality_options
+
+
+def parse_quality_options(info):
+    formats = info.get("formats") or []
 
     print("🔍 Full Video Formats Info:")
     for fmt in formats:
@@ -48,18 +190,8 @@ def get_video_formats(url):
             height = fmt.get("height")
             format_note = fmt.get("format_note")
             format_id = fmt.get("format_id")
-            filesize = fmt.get("filesize", 0)
-
-            duration = info.get("duration", 0)
-            tbr = fmt.get("tbr")  # in kbps
-            print(f"tbr: {tbr}")
-            print(f"duration: {duration}")
-            # Estimate size if filesize is missing
-            if not fmt.get("filesize") and tbr and duration:
-                estimated_filesize = int((tbr * 1024 / 8) * duration)  # bytes
-            else:
-                estimated_filesize = fmt.get("filesize", 0)
-
+            # filesize, filesize_approx or bitrate x duration, with how sure we are
+            estimated_filesize, confidence = estimate_format_size(fmt, info.get("duration"))
 
             # 🔍 Determine readable label
             if format_note:
@@ -72,13 +204,55 @@ def get_video_formats(url):
             quality_options.append({
                 "format_id": str(format_id),
                 "label": label,
-                "filesize": estimated_filesize
+                "filesize": estimated_filesize,
+                "size_confidence": confidence,
             })
 
     return quality_options
 
-def download(url, format_id):
-    sanitized_info = get_video_info(url)
+def audio_codec(fmt):
+    acodec = (fmt.get("acodec") or "").lower()
+    if acodec.startswith(("mp4a", "aac")):
+        return "m4a"
+    if acodec.startswith("mp3"):
+        return "mp3"
+    return None  # needs re-encoding
+
+
+def parse_audio_option(info):
+    # Best audio-only format, preferring ones that remux without re-encoding;
+    # sites without separate audio get the smallest muxed format instead
+    formats = [fmt for fmt in info.get("formats") or [] if fmt.get("acodec") != "none"]
+    audio_only = [fmt for fmt in formats if fmt.get("vcodec") == "none"]
+    if audio_only:
+        source = max(audio_only, key=lambda fmt: (audio_codec(fmt) is not None, fmt.get("abr") or fmt.get("tbr") or 0))
+    elif formats:
+        source = min(formats, key=lambda fmt: (fmt.get("height") or 0, fmt.get("tbr") or 0))
+    else:
+        return None
+    estimated_filesize, confidence = estimate_format_size(source, info.get("duration"))
+    return {
+        "format_id": AUDIO_FORMAT,
+        "label": "🎵 Audio only",
+        "filesize": estimated_filesize,
+        "size_confidence": confidence,
+        "source_format_id": str(source.get("format_id")),
+        "codec": audio_codec(source) or "mp3",
+    }
+
+
+def audio_selection(metadata):
+    # (format spec, codec to extract to)
+    option = metadata.audio_option
+    if option is None:
+        return "bestaudio/best", "mp3"
+    return f"{option['source_format_id']}/bestaudio/best", option["codec"]
+
+
+def download(url, format_id, metadata=None, max_filesize=None, progress_hook=None, output_dir=SCRATCH_DIR):
+    if metadata is None:
+        metadata = extract_metadata(url)
+    sanitized_info = metadata.info
 
     title = sanitized_info.get("title", "unknown_title")
     sanitized_title = re.sub(r'[\\/*?:"<>|]', '_', title)
@@ -88,19 +262,27 @@ def download(url, format_id):
     unique_suffix = uuid4().hex[:6]
 
     # Construct safe output path
-    output_path = f"/tmp/{truncated_title}_{unique_suffix}_%(id)s.%(ext)s"
+    output_path = os.path.join(output_dir, f"{truncated_title}_{unique_suffix}_%(id)s.%(ext)s")
     print(f"[🎯] This is: {output_path}")
-    ydl_opts = {
+    profile_name = profile_name_for(sanitized_info.get("extractor_key"))
+    format_spec, audio_codec = format_id or "best", None
+    if format_id == AUDIO_FORMAT:
+        format_spec, audio_codec = audio_selection(metadata)
+    call_options = {
         "outtmpl": output_path,
-        "cookies": "cookies.txt",
-        "cookies-from-browser": "chrome",
-        "format": format_id or "best",
-        "verbose": True
+        "format": format_spec,
+        "progress_hooks": [progress_hook] if progress_hook else [],
     }
+    if max_filesize:
+        # yt-dlp skips formats it knows are too big; the hook aborts the rest mid-download
+        call_options["max_filesize"] = max_filesize
+        call_options["progress_hooks"].append(size_limit_hook(max_filesize))
 
     file_paths = []
-    with YoutubeDL(ydl_opts) as ydl:
-        info_dict = ydl.extract_info(url, download=True)
+    profile = download_profile(profile_name, audio_codec)
+    with ydl_pool.lease(profile, download_options(profile_name, audio_codec), **call_options) as ydl:
+        # Reuse the info we already extracted instead of resolving the URL again
+        info_dict = ydl.process_ie_result(copy.deepcopy(sanitized_info), download=True)
 
         if "entries" in info_dict:
             for idx, entry in enumerate(info_dict["entries"], start=1):
@@ -113,6 +295,11 @@ def download(url, format_id):
                 os.rename(filename, unique_filename)
                 file_paths.append(unique_filename)
         else:
-            file_paths.append(ydl.prepare_filename(info_dict))
+            # Post-processors (audio extraction, merges) change the extension
+            requested = info_dict.get("requested_downloads") or [{}]
+            file_paths.append(requested[-1].get("filepath") or ydl.prepare_filename(info_dict))
 
+    # yt-dlp only reports a max_filesize skip on screen; the file is simply missing
+    if max_filesize and not all(os.path.exists(path) for path in file_paths):
+        raise FileTooLargeError(f"download exceeds {max_filesize} bytes")
     return file_paths
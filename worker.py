@@ -0,0 +1,57 @@
+# Standalone download workers. They claim jobs from the durable queue in
+# videos.db, so the bot process only has to answer updates:
+#
+#   QUEUE_WORKERS=0 python main.py                 # bot, no in-process downloads
+#   WORKER_PROCESSES=4 python worker.py            # 4 processes x WORKER_CONCURRENCY jobs
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from main import build_application, init_db, process_queue, collect_runtime_metrics
+from metrics import flush_loop
+from scratch import sweep_orphans
+import telemetry
+from executors import download_pool
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", download_pool.workers))
+
+
+async def run_worker(index=0):
+    init_db()
+    sweep_orphans()
+    app = build_application()
+    await app.initialize()
+    logger.info(f"Worker process {os.getpid()} running {WORKER_CONCURRENCY} jobs at a time")
+    asyncio.create_task(flush_loop())
+    # Next to the bot's endpoint: worker n serves METRICS_PORT + 1 + n
+    if telemetry.METRICS_PORT:
+        await telemetry.start_metrics_server(telemetry.METRICS_PORT + 1 + index)
+    telemetry.collectors.append(collect_runtime_metrics)
+    telemetry.workers_total.set(WORKER_CONCURRENCY)
+    telemetry.workers_busy.set(0)
+    try:
+        await asyncio.gather(*(process_queue(app, worker_id) for worker_id in range(WORKER_CONCURRENCY)))
+    finally:
+        await app.shutdown()
+
+
+def worker_main(index=0):
+    asyncio.run(run_worker(index))
+
+
+if __name__ == "__main__":
+    if WORKER_PROCESSES <= 1:
+        worker_main()
+    else:
+        processes = [
+            multiprocessing.Process(target=worker_main, args=(index,), name=f"worker-{index}")
+            for index in range(WORKER_PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
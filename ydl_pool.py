@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+COOKIE_FILE = os.getenv("COOKIE_FILE", "cookies.txt")
+YDL_POOL_IDLE = int(os.getenv("YDL_POOL_IDLE", 4))  # idle instances kept per profile
+YDL_MAX_USES = int(os.getenv("YDL_MAX_USES", 200))  # then a fresh one (yt-dlp keeps per-message state)
+
+_cookiejar = None
+_cookiejar_lock = threading.Lock()
+
+
+def shared_cookiejar():
+    # cookies.txt is parsed once; every instance reads and updates the same
+    # in-memory jar (CookieJar locks internally, so worker threads can share
+    # it). The file is input only and never written back: several bot and
+    # worker processes load it, and it is checked into the deployment.
+    global _cookiejar
+    with _cookiejar_lock:
+        if _cookiejar is None:
+            from yt_dlp.cookies import YoutubeDLCookieJar
+
+            _cookiejar = YoutubeDLCookieJar(COOKIE_FILE)
+            if os.path.exists(COOKIE_FILE):
+                _cookiejar.load()
+                logger.info(f"Loaded {len(_cookiejar)} cookies from {COOKIE_FILE}")
+        return _cookiejar
+
+
+class YoutubeDLPool:
+    # Initialized YoutubeDL instances, kept per option profile and lent to one
+    # thread at a time. Reusing an instance keeps its extractors, the shared
+    # cookie jar and its HTTP sessions (keep-alive per host), so a request
+    # only pays for the network work.
+    def __init__(self, max_idle=YDL_POOL_IDLE, max_uses=YDL_MAX_USES):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.idle = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, options):
+        from yt_dlp import YoutubeDL
+
+        ydl = YoutubeDL(options)
+        # A cached_property; set before the first request builds the handlers
+        ydl.cookiejar = shared_cookiejar()
+        return ydl
+
+    def _take(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return None
+
+    def _give_back(self, key, ydl):
+        with self.lock:
+            self.uses[id(ydl)] = self.uses.get(id(ydl), 0) + 1
+            idle = self.idle.setdefault(key, [])
+            if self.uses[id(ydl)] < self.max_uses and len(idle) < self.max_idle:
+                idle.append(ydl)
+                return
+            del self.uses[id(ydl)]
+        ydl.close()
+
+    @contextmanager
+    def lease(self, key, options, outtmpl=None, format=None, progress_hooks=(), **params):
+        # `options` builds the instance the first time `key` is needed; the
+        # rest only applies to this lease and is undone afterwards
+        ydl = self._take(key) or self._create(options)
+        saved_params = dict(ydl.params)
+        saved_selector = ydl.format_selector
+        try:
+            ydl.params.update(params)
+            if outtmpl is not None:
+                ydl.params["outtmpl"] = {**saved_params["outtmpl"], "default": outtmpl}
+            if format is not None:
+                ydl.params["format"] = format
+                ydl.format_selector = ydl.build_format_selector(format)
+            ydl._progress_hooks = list(progress_hooks)
+            yield ydl
+        finally:
+            ydl.params.clear()
+            ydl.params.update(saved_params)
+            ydl.format_selector = saved_selector
+            ydl._progress_hooks = []
+            ydl._download_retcode = 0
+            self._give_back(key, ydl)
+
+    def warm(self, key, options):
+        with self.lease(key, options):
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": sum(len(idle) for idle in self.idle.values()),
+                "profiles": len(self.idle),
+            }
+
+
+ydl_pool = YoutubeDLPool()